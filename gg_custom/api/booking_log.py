@@ -0,0 +1,266 @@
+import frappe
+from frappe.model.naming import set_new_name
+from toolz.curried import groupby, valmap, merge, first, filter
+
+from gg_custom.api.booking_order import clear_history_cache
+
+
+def insert_logs(logs):
+    docs = [frappe.get_doc(merge({"doctype": "Booking Log"}, x)) for x in logs]
+    if not docs:
+        return docs
+
+    validate_loading_units(docs)
+
+    now = frappe.utils.now()
+    user = frappe.session.user
+    for doc in docs:
+        doc.update(
+            {"owner": user, "modified_by": user, "creation": now, "modified": now}
+        )
+        set_new_name(doc)
+
+    rows = [x.get_valid_dict(convert_dates_to_str=True) for x in docs]
+    fields = list(rows[0].keys())
+    frappe.db.bulk_insert(
+        "Booking Log",
+        fields=fields,
+        values=[[x.get(field) for field in fields] for x in rows],
+    )
+    update_balances(docs)
+    clear_history_cache([x.booking_order for x in docs])
+
+    return docs
+
+
+def delete_logs(doctype, filters):
+    if doctype not in ["Booking Log", "Shipping Log"]:
+        frappe.throw(f"Invalid log type: {doctype}")
+
+    if doctype == "Booking Log":
+        logs = frappe.get_all(
+            "Booking Log",
+            filters=filters,
+            fields=[
+                "name",
+                "booking_order",
+                "bo_detail",
+                "station",
+                "shipping_order",
+                "loading_unit",
+                "no_of_packages",
+                "weight_actual",
+            ],
+        )
+        if logs:
+            update_balances(logs, reverse=True)
+            frappe.db.delete(
+                "Booking Log", {"name": ("in", [x.get("name") for x in logs])}
+            )
+            clear_history_cache([x.get("booking_order") for x in logs])
+        return
+
+    frappe.db.delete(doctype, filters)
+
+
+def validate_loading_units(logs):
+    loads = [x for x in logs if x.get("activity") != "Booked"]
+    if not loads:
+        return
+
+    BookingLog = frappe.qb.DocType("Booking Log")
+    q = (
+        frappe.qb.from_(BookingLog)
+        .where(BookingLog.bo_detail.isin(list(set(x.get("bo_detail") for x in loads))))
+        .where(BookingLog.activity != "Booked")
+        .select(BookingLog.booking_order, BookingLog.bo_detail, BookingLog.loading_unit)
+        .distinct()
+    )
+    names = [x.get("name") for x in loads if x.get("name")]
+    if names:
+        q = q.where(BookingLog.name.notin(names))
+
+    def get_key(log):
+        return log.get("booking_order"), log.get("bo_detail")
+
+    loading_units = valmap(
+        lambda rows: set(x.get("loading_unit") for x in rows if x.get("loading_unit")),
+        groupby(get_key, q.run(as_dict=1) + loads),
+    )
+    for log in loads:
+        others = loading_units.get(get_key(log)) - {log.get("loading_unit")}
+        if others:
+            frappe.throw(
+                frappe._(
+                    "Previous Loading Operation on {} has already being performed based on {}. ".format(
+                        frappe.get_desk_link("Booking Order", log.get("booking_order")),
+                        first(sorted(others)),
+                    )
+                    + "Please execute the current one based on the same unit."
+                )
+            )
+
+
+def update_balances(logs, reverse=False):
+    sign = -1 if reverse else 1
+    _update_balance("Station Balance", "station", logs, sign)
+    _update_balance("Onboard Balance", "shipping_order", logs, -sign)
+    if reverse:
+        # reversed logs are still in the table, so they are left out explicitly
+        _reset_loading_units("Station Balance", "station", logs)
+        _reset_loading_units("Onboard Balance", "shipping_order", logs)
+
+
+def rebuild_station_balances():
+    _rebuild_balance("Station Balance", "station", 1)
+
+
+def rebuild_onboard_balances():
+    _rebuild_balance("Onboard Balance", "shipping_order", -1)
+
+
+def _get_balance_rows(key, logs, sign):
+    def make_row(item):
+        (key_value, bo_detail), rows = item
+        return {
+            key: key_value,
+            "bo_detail": bo_detail,
+            "booking_order": rows[0].get("booking_order"),
+            "loading_unit": max(
+                [x.get("loading_unit") for x in rows if x.get("loading_unit")],
+                default=None,
+            ),
+            "no_of_packages": sign * sum([x.get("no_of_packages") or 0 for x in rows]),
+            "weight_actual": sign * sum([x.get("weight_actual") or 0 for x in rows]),
+        }
+
+    grouped = groupby(
+        lambda x: (x.get(key), x.get("bo_detail")),
+        filter(lambda x: x.get(key) and x.get("bo_detail"), logs),
+    )
+    return [make_row(x) for x in grouped.items()]
+
+
+def _update_balance(doctype, key, logs, sign):
+    rows = _get_balance_rows(key, logs, sign)
+    if not rows:
+        return
+
+    now = frappe.utils.now()
+    user = frappe.session.user
+    placeholder = "({}, {})".format(
+        _get_balance_name("%s", "%s"), ", ".join(["%s"] * 10)
+    )
+    frappe.db.sql(
+        """
+            INSERT INTO `tab{doctype}` (
+                name, creation, modified, owner, modified_by,
+                {key}, bo_detail, booking_order, loading_unit,
+                no_of_packages, weight_actual
+            ) VALUES {values}
+            ON DUPLICATE KEY UPDATE
+                modified = VALUES(modified),
+                modified_by = VALUES(modified_by),
+                loading_unit = IFNULL(VALUES(loading_unit), loading_unit),
+                no_of_packages = no_of_packages + VALUES(no_of_packages),
+                weight_actual = weight_actual + VALUES(weight_actual)
+        """.format(
+            doctype=doctype,
+            key=key,
+            values=", ".join([placeholder] * len(rows)),
+        ),
+        values=[
+            y
+            for x in rows
+            for y in (
+                x.get(key),
+                x.get("bo_detail"),
+                now,
+                now,
+                user,
+                user,
+                x.get(key),
+                x.get("bo_detail"),
+                x.get("booking_order"),
+                x.get("loading_unit"),
+                x.get("no_of_packages"),
+                x.get("weight_actual"),
+            )
+        ],
+    )
+    frappe.db.sql(
+        """
+            DELETE FROM `tab{doctype}`
+            WHERE
+                ({key}, bo_detail) IN %(keys)s AND
+                no_of_packages = 0 AND
+                weight_actual = 0
+        """.format(
+            doctype=doctype, key=key
+        ),
+        values={"keys": tuple((x.get(key), x.get("bo_detail")) for x in rows)},
+    )
+
+
+def _rebuild_balance(doctype, key, sign):
+    frappe.db.delete(doctype)
+    frappe.db.sql(
+        """
+            INSERT INTO `tab{doctype}` (
+                name, creation, modified, owner, modified_by,
+                {key}, bo_detail, booking_order, loading_unit,
+                no_of_packages, weight_actual
+            )
+            SELECT
+                {name},
+                NOW(),
+                NOW(),
+                'Administrator',
+                'Administrator',
+                {key},
+                bo_detail,
+                MAX(booking_order),
+                MAX(loading_unit),
+                {sign} * SUM(no_of_packages),
+                {sign} * SUM(weight_actual)
+            FROM `tabBooking Log`
+            WHERE IFNULL({key}, '') != '' AND IFNULL(bo_detail, '') != ''
+            GROUP BY {key}, bo_detail
+            HAVING SUM(no_of_packages) != 0 OR SUM(weight_actual) != 0
+        """.format(
+            doctype=doctype,
+            key=key,
+            sign=sign,
+            name=_get_balance_name(key, "bo_detail"),
+        )
+    )
+
+
+def _reset_loading_units(doctype, key, logs):
+    rows = _get_balance_rows(key, logs, 1)
+    if not rows:
+        return
+
+    frappe.db.sql(
+        """
+            UPDATE `tab{doctype}` AS balance SET loading_unit = (
+                SELECT MAX(log.loading_unit) FROM `tabBooking Log` AS log
+                WHERE
+                    log.{key} = balance.{key} AND
+                    log.bo_detail = balance.bo_detail AND
+                    log.name NOT IN %(names)s
+            )
+            WHERE (balance.{key}, balance.bo_detail) IN %(keys)s
+        """.format(
+            doctype=doctype, key=key
+        ),
+        values={
+            "names": tuple(x.get("name") for x in logs),
+            "keys": tuple((x.get(key), x.get("bo_detail")) for x in rows),
+        },
+    )
+
+
+def _get_balance_name(key, bo_detail):
+    # balance rows are named after their key so that rebuilds keep the same names
+    return "MD5(CONCAT({}, ':', {}))".format(key, bo_detail)
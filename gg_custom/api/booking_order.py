@@ -1,18 +1,20 @@
 import frappe
 from frappe.query_builder import Criterion
-from frappe.query_builder.functions import Sum, Max
+from frappe.query_builder.functions import IfNull
 from frappe.contacts.doctype.address.address import (
     get_company_address,
     get_address_display,
 )
 from erpnext.accounts.doctype.payment_entry.payment_entry import get_payment_entry
+from erpnext.controllers.accounts_controller import (
+    get_default_taxes_and_charges,
+    get_taxes_and_charges,
+)
 from erpnext.stock.get_item_details import get_item_price
 from toolz.curried import (
     compose,
     merge,
     unique,
-    sliding_window,
-    concat,
     groupby,
     valmap,
     first,
@@ -20,6 +22,8 @@ from toolz.curried import (
     filter,
 )
 
+from gg_custom.api.utils import get_cached_dashboard_info, clear_dashboard_info
+
 
 @frappe.whitelist()
 def query(doctype, txt, searchfield, start, page_len, filters):
@@ -61,55 +65,100 @@ def query(doctype, txt, searchfield, start, page_len, filters):
 
 @frappe.whitelist()
 def get_history(name):
-    booking_logs = frappe.get_all(
-        "Booking Log",
-        filters={"booking_order": name},
-        fields=[
-            "'Booking Log' as doctype",
-            "posting_datetime",
-            "booking_order",
-            "shipping_order",
-            "station",
-            "activity",
-            "loading_operation",
-            "loading_unit",
-            "sum(no_of_packages) as no_of_packages",
-            "sum(weight_actual) as weight_actual",
-        ],
-        order_by="posting_datetime",
-        group_by="posting_datetime,activity",
+    return frappe.cache().hget(
+        "booking_order_history", name, generator=lambda: _get_history(name)
     )
 
-    get_shipping_logs = compose(
-        concat,
-        map(
-            lambda x: frappe.get_all(
-                "Shipping Log",
-                filters={
-                    "shipping_order": x[0].get("shipping_order"),
-                    "activity": ("in", ["Stopped", "Moving"]),
-                    "posting_datetime": (
-                        "between",
-                        [x[0].get("posting_datetime"), x[1].get("posting_datetime")],
-                    ),
-                },
-                fields=[
-                    "'Shipping Log' as doctype",
-                    "posting_datetime",
-                    "shipping_order",
-                    "station",
-                    "activity",
-                ],
-                order_by="posting_datetime",
-            )
-            if x[0].get("shipping_order")
-            else []
-        ),
-        sliding_window(2),
+
+def clear_history_cache(booking_orders):
+    for name in set(booking_orders):
+        if name:
+            frappe.cache().hdel("booking_order_history", name)
+    clear_dashboard_cache(booking_orders)
+
+
+@frappe.whitelist()
+def get_dashboard_info(name):
+    frappe.has_permission("Booking Order", "read", name, throw=True)
+    return get_cached_dashboard_info(
+        "booking_order_dashboard_info", name, lambda: _get_dashboard_info(name)
     )
 
-    shipping_logs = get_shipping_logs(
-        booking_logs + [{"posting_datetime": frappe.utils.now()}]
+
+def clear_dashboard_cache(booking_orders):
+    clear_dashboard_info("booking_order_dashboard_info", booking_orders)
+
+
+def _get_dashboard_info(name):
+    from gg_custom.doc_events.sales_invoice import get_billing_totals
+
+    billing = get_billing_totals([name]).get(name) or {}
+    return {
+        "invoice": {
+            "grand_total": billing.get("grand_total"),
+            "outstanding_amount": billing.get("outstanding_amount"),
+        },
+        "history": get_history(name),
+    }
+
+
+def _get_history(name):
+    # shipping logs are picked from the period each booking log is in effect
+    logs = frappe.db.sql(
+        """
+            WITH booking_logs AS (
+                SELECT
+                    posting_datetime,
+                    activity,
+                    MAX(shipping_order) AS shipping_order,
+                    MAX(station) AS station,
+                    MAX(loading_operation) AS loading_operation,
+                    MAX(loading_unit) AS loading_unit,
+                    SUM(no_of_packages) AS no_of_packages,
+                    SUM(weight_actual) AS weight_actual
+                FROM `tabBooking Log`
+                WHERE booking_order = %(name)s
+                GROUP BY posting_datetime, activity
+            ), periods AS (
+                SELECT
+                    shipping_order,
+                    posting_datetime AS from_datetime,
+                    LEAD(posting_datetime, 1, %(now)s) OVER (
+                        ORDER BY posting_datetime, activity
+                    ) AS to_datetime
+                FROM booking_logs
+            )
+            SELECT
+                'Booking Log' AS doctype,
+                posting_datetime,
+                shipping_order,
+                station,
+                activity,
+                loading_operation,
+                loading_unit,
+                no_of_packages,
+                weight_actual
+            FROM booking_logs
+            UNION ALL
+            SELECT
+                'Shipping Log' AS doctype,
+                sl.posting_datetime,
+                sl.shipping_order,
+                sl.station,
+                sl.activity,
+                NULL,
+                NULL,
+                NULL,
+                NULL
+            FROM periods
+            JOIN `tabShipping Log` AS sl ON
+                sl.shipping_order = periods.shipping_order AND
+                sl.posting_datetime BETWEEN periods.from_datetime AND periods.to_datetime
+            WHERE sl.activity IN ('Stopped', 'Moving')
+            ORDER BY posting_datetime, doctype
+        """,
+        values={"name": name, "now": frappe.utils.now()},
+        as_dict=1,
     )
 
     def get_message(log):
@@ -147,14 +196,12 @@ def get_history(name):
             "link": get_link(log),
         }
 
-    return sorted(
-        [get_event(x) for x in concat([booking_logs, shipping_logs])],
-        key=lambda x: frappe.utils.get_datetime(x.get("datetime")),
-    )
+    return [get_event(x) for x in logs]
 
 
 @frappe.whitelist()
 def make_sales_invoice(source_name, target_doc=None, posting_datetime=None):
+    # args are passed through frappe.flags by frappe.model.mapper.make_mapped_doc
     if not frappe.flags.args:
         frappe.throw(frappe._("args missing while trying to create Sales Invoice"))
 
@@ -168,98 +215,222 @@ def make_sales_invoice(source_name, target_doc=None, posting_datetime=None):
             frappe._("Cannot create freight Sales Invoice without Loading Operation")
         )
 
-    def set_invoice_missing_values(source, target):
-        target.customer = _get_or_create_customer(source_name, bill_to)
-        target.update(
-            frappe.model.utils.get_fetch_values(
-                "Sales Invoice", "customer", target.customer
-            )
+    return make_sales_invoices(
+        [(source_name, bill_to)],
+        loading_operation=loading_operation if is_freight_invoice else None,
+        taxes_and_charges=taxes_and_charges,
+        posting_datetime=posting_datetime,
+        target_doc=target_doc,
+    )[0]
+
+
+def make_sales_invoices(
+    booking_orders,
+    loading_operation=None,
+    taxes_and_charges=None,
+    posting_datetime=None,
+    target_doc=None,
+    context=None,
+    submit=False,
+):
+    """
+    Build Sales Invoices for a list of (booking_order, bill_to) pairs.
+
+    Freight invoices are made for the loads in loading_operation when it is set,
+    charge invoices otherwise. Values shared between invoices are resolved once
+    in context, which can also be passed in by callers that build invoices over
+    several calls. When submit is set, the invoices are inserted and submitted.
+    """
+    if target_doc and len(booking_orders) > 1:
+        frappe.throw(
+            frappe._("Cannot map more than one Booking Order into the same invoice")
         )
-        target.customer_address = frappe.get_cached_value(
-            "Booking Order", source_name, "{}_address".format(bill_to)
+
+    _context = context or get_sales_invoice_context(
+        [x for x, _ in booking_orders],
+        loading_operation=loading_operation,
+        taxes_and_charges=taxes_and_charges,
+    )
+    invoices = [
+        _make_sales_invoice(
+            booking_order,
+            bill_to,
+            _context,
+            loading_operation=loading_operation,
+            taxes_and_charges=taxes_and_charges,
+            posting_datetime=posting_datetime,
+            target_doc=target_doc,
         )
-        if target.customer_address:
-            target.update(
-                frappe.model.utils.get_fetch_values(
-                    "Sales Invoice", "customer_address", target.customer_address
-                )
-            )
-        target.taxes_and_charges = taxes_and_charges
-        target.ignore_pricing_rule = 1
-        if posting_datetime:
-            target.set_posting_time = 1
-            dt = frappe.utils.get_datetime(posting_datetime)
-            target.posting_date = dt.date()
-            target.posting_time = dt.time()
-        target.run_method("set_missing_values")
-        target.run_method("calculate_taxes_and_totals")
-        target.update(get_company_address(target.company))
-        if target.company_address:
-            target.update(
-                frappe.model.utils.get_fetch_values(
-                    "Sales Invoice", "company_address", target.company_address
+        for booking_order, bill_to in booking_orders
+    ]
+    if submit:
+        for invoice in invoices:
+            invoice.flags.skip_validation = bool(loading_operation)
+            invoice.insert(ignore_permissions=True)
+            invoice.submit()
+
+    return invoices
+
+
+def get_sales_invoice_context(
+    booking_orders, loading_operation=None, taxes_and_charges=None
+):
+    names = list(set(booking_orders))
+    return frappe._dict(
+        {
+            "freight_rates": get_freight_rates(),
+            "freight_rows": _get_freight_rows(names, loading_operation)
+            if loading_operation
+            else {},
+            "booking_orders": {
+                x.get("name"): x
+                for x in frappe.get_all(
+                    "Booking Order",
+                    filters={"name": ("in", names)},
+                    fields=[
+                        "name",
+                        "docstatus",
+                        "consignor",
+                        "consignee",
+                        "consignor_address",
+                        "consignee_address",
+                    ],
                 )
+            }
+            if names
+            else {},
+            **_get_taxes(taxes_and_charges),
+            "fetch_values": {},
+            "company_addresses": {},
+        }
+    )
+
+
+def _get_taxes(taxes_and_charges=None):
+    # falls back to the default template of the company the invoices are made in
+    if not taxes_and_charges:
+        return frappe._dict(
+            get_default_taxes_and_charges(
+                "Sales Taxes and Charges Template",
+                company=frappe.defaults.get_user_default("Company"),
             )
+            or {"taxes_and_charges": None, "taxes": []}
+        )
 
-    def get_qty_field(based_on):
-        if based_on == "Packages":
-            return "no_of_packages"
-        if based_on == "Weight":
-            return "weight_actual"
+    return frappe._dict(
+        {
+            "taxes_and_charges": taxes_and_charges,
+            "taxes": get_taxes_and_charges(
+                "Sales Taxes and Charges Template", taxes_and_charges
+            ),
+        }
+    )
 
-    def postprocess(source, target):
-        if not is_freight_invoice:
-            return set_invoice_missing_values(source, target)
 
-        BookingOrderFreightDetail = frappe.qb.DocType("Booking Order Freight Detail")
-        LoadingOperationBookingOrder = frappe.qb.DocType(
-            "Loading Operation Booking Order"
+def _get_freight_rows(booking_orders, loading_operation):
+    if not booking_orders:
+        return {}
+
+    BookingOrderFreightDetail = frappe.qb.DocType("Booking Order Freight Detail")
+    LoadingOperationBookingOrder = frappe.qb.DocType("Loading Operation Booking Order")
+    q = (
+        frappe.qb.from_(LoadingOperationBookingOrder)
+        .left_join(BookingOrderFreightDetail)
+        .on(BookingOrderFreightDetail.name == LoadingOperationBookingOrder.bo_detail)
+        .where(
+            (LoadingOperationBookingOrder.parent == loading_operation)
+            & (LoadingOperationBookingOrder.booking_order.isin(booking_orders))
         )
-        q = (
-            frappe.qb.from_(LoadingOperationBookingOrder)
-            .left_join(BookingOrderFreightDetail)
-            .on(
-                BookingOrderFreightDetail.name == LoadingOperationBookingOrder.bo_detail
-            )
-            .where(
-                (LoadingOperationBookingOrder.parent == loading_operation)
-                & (LoadingOperationBookingOrder.booking_order == source_name)
-            )
-            .select(
-                BookingOrderFreightDetail.name.as_("bo_detail"),
-                LoadingOperationBookingOrder.no_of_packages,
-                LoadingOperationBookingOrder.weight_actual,
-                BookingOrderFreightDetail.based_on,
-                BookingOrderFreightDetail.rate,
-                BookingOrderFreightDetail.item_description,
-            )
-            .orderby(BookingOrderFreightDetail.idx)
-            .orderby(LoadingOperationBookingOrder.idx)
+        .select(
+            LoadingOperationBookingOrder.booking_order,
+            BookingOrderFreightDetail.name.as_("bo_detail"),
+            LoadingOperationBookingOrder.no_of_packages,
+            LoadingOperationBookingOrder.weight_actual,
+            BookingOrderFreightDetail.based_on,
+            BookingOrderFreightDetail.rate,
+            BookingOrderFreightDetail.item_description,
         )
+        .orderby(BookingOrderFreightDetail.idx)
+        .orderby(LoadingOperationBookingOrder.idx)
+    )
 
-        freight_rows = q.run(as_dict=1)
+    return groupby(lambda x: x.get("booking_order"), q.run(as_dict=1))
 
-        target.gg_loading_operation = loading_operation
-        target.items = []
-        freight_rates = get_freight_rates()
-        for row in freight_rows:
-            based_on = row.get("based_on")
-            freight_item = freight_rates.get(based_on) or {}
-            target.append(
-                "items",
-                {
-                    "item_code": freight_item.get("item_code"),
-                    "price_list_rate": freight_item.get("rate"),
-                    "qty": row.get(get_qty_field(based_on)),
-                    "rate": row.get("rate"),
-                    "stock_uom": freight_item.get("uom"),
-                    "uom": freight_item.get("uom"),
-                    "description": row.get("item_description"),
-                    "gg_bo_detail": row.get("bo_detail"),
-                },
+
+def make_consolidated_sales_invoice(
+    booking_orders, loading_operation, posting_datetime=None, context=None, submit=False
+):
+    """
+    Build one freight Sales Invoice for (booking_order, bill_to) pairs in
+    loading_operation that are all billed to the same Booking Party. Each item
+    links back to its Booking Order through gg_booking_order and gg_bo_detail.
+    """
+    _context = context or get_sales_invoice_context(
+        [x for x, _ in booking_orders], loading_operation=loading_operation
+    )
+    parties = set(
+        (_context.booking_orders.get(x) or {}).get(bill_to)
+        for x, bill_to in booking_orders
+    )
+    if len(parties) != 1:
+        frappe.throw(
+            frappe._(
+                "Consolidated Sales Invoice can only be made for a single Booking Party"
+            )
+        )
+
+    for booking_order, _ in booking_orders:
+        if (_context.booking_orders.get(booking_order) or {}).get("docstatus") != 1:
+            frappe.throw(
+                frappe._(
+                    "{} is not submitted".format(
+                        frappe.get_desk_link("Booking Order", booking_order)
+                    )
+                )
             )
 
-        return set_invoice_missing_values(source, target)
+    invoice = frappe.new_doc("Sales Invoice")
+    invoice.gg_loading_operation = loading_operation
+    for booking_order, _ in booking_orders:
+        _append_freight_items(invoice, booking_order, _context)
+    _set_invoice_missing_values(
+        invoice, *booking_orders[0], _context, posting_datetime=posting_datetime
+    )
+
+    if submit:
+        invoice.flags.skip_validation = True
+        invoice.insert(ignore_permissions=True)
+        invoice.submit()
+
+    return invoice
+
+
+def _make_sales_invoice(
+    source_name,
+    bill_to,
+    context,
+    loading_operation=None,
+    taxes_and_charges=None,
+    posting_datetime=None,
+    target_doc=None,
+):
+    def postprocess(source, target):
+        if loading_operation:
+            target.gg_loading_operation = loading_operation
+            target.items = []
+            _append_freight_items(target, source_name, context)
+
+        for item in target.items:
+            item.gg_booking_order = source_name
+
+        return _set_invoice_missing_values(
+            target,
+            source_name,
+            bill_to,
+            context,
+            taxes_and_charges=taxes_and_charges,
+            posting_datetime=posting_datetime,
+        )
 
     def get_table_maps():
         common = {
@@ -269,7 +440,7 @@ def make_sales_invoice(source_name, target_doc=None, posting_datetime=None):
                 "validation": {"docstatus": ["=", 1]},
             },
         }
-        if is_freight_invoice:
+        if loading_operation:
             return common
 
         return merge(
@@ -291,6 +462,82 @@ def make_sales_invoice(source_name, target_doc=None, posting_datetime=None):
     )
 
 
+def _append_freight_items(target, booking_order, context):
+    def get_qty_field(based_on):
+        if based_on == "Packages":
+            return "no_of_packages"
+        if based_on == "Weight":
+            return "weight_actual"
+
+    for row in context.freight_rows.get(booking_order, []):
+        based_on = row.get("based_on")
+        freight_item = context.freight_rates.get(based_on) or {}
+        target.append(
+            "items",
+            {
+                "item_code": freight_item.get("item_code"),
+                "price_list_rate": freight_item.get("rate"),
+                "qty": row.get(get_qty_field(based_on)),
+                "rate": row.get("rate"),
+                "stock_uom": freight_item.get("uom"),
+                "uom": freight_item.get("uom"),
+                "description": row.get("item_description"),
+                "gg_bo_detail": row.get("bo_detail"),
+                "gg_booking_order": booking_order,
+            },
+        )
+
+
+def _set_invoice_missing_values(
+    target,
+    booking_order,
+    bill_to,
+    context,
+    taxes_and_charges=None,
+    posting_datetime=None,
+):
+    def get_fetch_values(fieldname, value):
+        key = (fieldname, value)
+        if key not in context.fetch_values:
+            context.fetch_values[key] = frappe.model.utils.get_fetch_values(
+                "Sales Invoice", fieldname, value
+            )
+        return context.fetch_values[key]
+
+    def get_company_address_values(company):
+        if company not in context.company_addresses:
+            values = get_company_address(company)
+            if values.get("company_address"):
+                values.update(
+                    get_fetch_values("company_address", values.get("company_address"))
+                )
+            context.company_addresses[company] = values
+        return context.company_addresses[company]
+
+    if not bill_to:
+        frappe.throw(frappe._("Cannot create Invoice without Customer"))
+
+    source = context.booking_orders.get(booking_order) or {}
+    target.customer = _get_or_create_customer(source.get(bill_to))
+    target.update(get_fetch_values("customer", target.customer))
+    target.customer_address = source.get("{}_address".format(bill_to))
+    if target.customer_address:
+        target.update(get_fetch_values("customer_address", target.customer_address))
+    target.taxes_and_charges = taxes_and_charges or context.taxes_and_charges
+    if context.taxes and not target.get("taxes"):
+        for tax in context.taxes:
+            target.append("taxes", tax)
+    target.ignore_pricing_rule = 1
+    if posting_datetime:
+        target.set_posting_time = 1
+        dt = frappe.utils.get_datetime(posting_datetime)
+        target.posting_date = dt.date()
+        target.posting_time = dt.time()
+    target.run_method("set_missing_values")
+    target.run_method("calculate_taxes_and_totals")
+    target.update(get_company_address_values(target.company))
+
+
 @frappe.whitelist()
 def make_payment_entry(source_name, target_doc=None):
     invoices = [
@@ -299,7 +546,7 @@ def make_payment_entry(source_name, target_doc=None):
             "Sales Invoice",
             filters={
                 "docstatus": 1,
-                "gg_booking_order": source_name,
+                "name": ("in", get_sales_invoices(source_name)),
                 "outstanding_amount": [">", 0],
             },
             order_by="posting_date, name",
@@ -320,40 +567,55 @@ def make_payment_entry(source_name, target_doc=None):
     return get_payment_entry_from_invoices("Sales Invoice", invoices)
 
 
+def get_sales_invoices(booking_order):
+    SalesInvoiceItem = frappe.qb.DocType("Sales Invoice Item")
+    return [
+        x
+        for (x,) in (
+            frappe.qb.from_(SalesInvoiceItem)
+            .where(SalesInvoiceItem.docstatus == 1)
+            .where(SalesInvoiceItem.gg_booking_order == booking_order)
+            .select(SalesInvoiceItem.parent)
+            .distinct()
+        ).run()
+    ]
+
+
 def get_payment_entry_from_invoices(invoice_type, invoices):
     if invoice_type not in ["Sales Invoice", "Purchase Invoice"]:
         frappe.throw(f"Invalid invoice type: {invoice_type}")
 
+    def get_allocated_amount(inv):
+        if inv.get("allocated_amount") is None:
+            return inv.outstanding_amount
+        return inv.get("allocated_amount")
+
     pe = get_payment_entry(invoice_type, invoices[0].name)
-    if len(invoices) > 1:
-        outstanding_amount = sum([x.outstanding_amount for x in invoices])
-        pe.paid_amount = outstanding_amount
-        pe.received_amount = outstanding_amount
+    if len(invoices) > 1 or any(
+        [get_allocated_amount(x) != x.outstanding_amount for x in invoices]
+    ):
+        paid_amount = sum([get_allocated_amount(x) for x in invoices])
+        pe.paid_amount = paid_amount
+        pe.received_amount = paid_amount
         pe.references = []
         for inv in invoices:
             pe.append(
                 "references",
                 {
-                    "reference_doctype": inv.doctype,
+                    "reference_doctype": invoice_type,
                     "reference_name": inv.name,
                     "bill_no": inv.get("bill_no"),
                     "due_date": inv.get("due_date"),
                     "total_amount": inv.grand_total,
                     "outstanding_amount": inv.outstanding_amount,
-                    "allocated_amount": inv.outstanding_amount,
+                    "allocated_amount": get_allocated_amount(inv),
                 },
             )
     return pe
 
 
-def _get_or_create_customer(booking_order_name, bill_to):
+def _get_or_create_customer(booking_party_name):
     msg = frappe._("Cannot create Invoice without Customer")
-    if not bill_to:
-        frappe.throw(msg)
-
-    booking_party_name = frappe.db.get_value(
-        "Booking Order", booking_order_name, bill_to
-    )
     if not booking_party_name:
         frappe.throw(msg)
 
@@ -368,7 +630,7 @@ def _get_or_create_customer(booking_order_name, bill_to):
     return booking_party.customer
 
 
-def get_orders_for(station=None, shipping_order=None):
+def get_orders_for(station=None, shipping_order=None, bo_details=None):
     def get_qty(row):
         if row.get("loading_unit") == "Packages":
             return row.get("no_of_packages")
@@ -380,82 +642,68 @@ def get_orders_for(station=None, shipping_order=None):
         qty = get_qty(row)
         return merge(row, {"qty": qty, "available": qty})
 
-    BookingLog = frappe.qb.DocType("Booking Log")
-    BookingOrderFreightDetail = frappe.qb.DocType("Booking Order Freight Detail")
+    balance = _get_balance(station=station, shipping_order=shipping_order)
+    if not balance:
+        return []
 
+    Balance, key = balance
+    BookingOrderFreightDetail = frappe.qb.DocType("Booking Order Freight Detail")
     q = (
-        frappe.qb.from_(BookingLog)
+        frappe.qb.from_(Balance)
         .left_join(BookingOrderFreightDetail)
-        .on(BookingOrderFreightDetail.name == BookingLog.bo_detail)
+        .on(BookingOrderFreightDetail.name == Balance.bo_detail)
+        .where(Balance[key] == (station or shipping_order))
+        .where((Balance.no_of_packages > 0) | (Balance.weight_actual > 0))
         .select(
-            BookingLog.booking_order,
-            Max(BookingLog.loading_unit).as_("loading_unit"),
-            BookingLog.bo_detail,
+            Balance.booking_order,
+            Balance.loading_unit,
+            Balance.bo_detail,
             BookingOrderFreightDetail.item_description.as_("description"),
+            Balance.no_of_packages,
+            Balance.weight_actual,
         )
+        .orderby(Balance.booking_order)
+        .orderby(BookingOrderFreightDetail.idx)
     )
+    if bo_details is not None:
+        if not bo_details:
+            return []
+        q = q.where(Balance.bo_detail.isin(list(bo_details)))
 
-    if station:
-        q = (
-            q.where(BookingLog.station == station)
-            .select(
-                Sum(BookingLog.no_of_packages).as_("no_of_packages"),
-                Sum(BookingLog.weight_actual).as_("weight_actual"),
-            )
-            .groupby(BookingLog.bo_detail)
-            .having(
-                (Sum(BookingLog.no_of_packages) > 0)
-                | (Sum(BookingLog.weight_actual) > 0)
-            )
-        )
-        return [set_qty(x) for x in q.run(as_dict=1)]
-
-    if shipping_order:
-        q = (
-            q.where(BookingLog.shipping_order == shipping_order)
-            .select(
-                -Sum(BookingLog.no_of_packages).as_("no_of_packages"),
-                -Sum(BookingLog.weight_actual).as_("weight_actual"),
-            )
-            .groupby(BookingLog.bo_detail)
-            .having(
-                (Sum(BookingLog.no_of_packages) < 0)
-                | (Sum(BookingLog.weight_actual) < 0)
-            )
-        )
-        return [set_qty(x) for x in q.run(as_dict=1)]
-
-    return []
+    return [set_qty(x) for x in q.run(as_dict=1)]
 
 
 @frappe.whitelist()
 def get_order_details(bo_detail, station=None, shipping_order=None):
-    BookingLog = frappe.qb.DocType("Booking Log")
-    BookingOrderFreightDetail = frappe.qb.DocType("Booking Order Freight Detail")
+    balance = _get_balance(station=station, shipping_order=shipping_order)
+    if not balance:
+        return {}
 
+    Balance, key = balance
+    BookingOrderFreightDetail = frappe.qb.DocType("Booking Order Freight Detail")
     q = (
-        frappe.qb.from_(BookingLog)
-        .left_join(BookingOrderFreightDetail)
-        .on(BookingOrderFreightDetail.name == BookingLog.bo_detail)
-        .where(BookingLog.bo_detail == bo_detail)
-        .select(BookingOrderFreightDetail.item_description.as_("description"))
+        frappe.qb.from_(BookingOrderFreightDetail)
+        .left_join(Balance)
+        .on(
+            (Balance.bo_detail == BookingOrderFreightDetail.name)
+            & (Balance[key] == (station or shipping_order))
+        )
+        .where(BookingOrderFreightDetail.name == bo_detail)
+        .select(
+            BookingOrderFreightDetail.item_description.as_("description"),
+            IfNull(Balance.no_of_packages, 0).as_("no_of_packages"),
+            IfNull(Balance.weight_actual, 0).as_("weight_actual"),
+        )
     )
+    return first(q.run(as_dict=1) or [{}])
 
-    if station:
-        q = q.where(BookingLog.station == station).select(
-            Sum(BookingLog.no_of_packages).as_("no_of_packages"),
-            Sum(BookingLog.weight_actual).as_("weight_actual"),
-        )
-        return q.run(as_dict=1)[0]
 
+def _get_balance(station=None, shipping_order=None):
+    if station:
+        return frappe.qb.DocType("Station Balance"), "station"
     if shipping_order:
-        q = q.where(BookingLog.shipping_order == shipping_order).select(
-            -Sum(BookingLog.no_of_packages).as_("no_of_packages"),
-            -Sum(BookingLog.weight_actual).as_("weight_actual"),
-        )
-        return q.run(as_dict=1)[0]
-
-    return {}
+        return frappe.qb.DocType("Onboard Balance"), "shipping_order"
+    return None
 
 
 @frappe.whitelist()
@@ -522,15 +770,12 @@ def get_loading_conversion_factor(qty, unit, no_of_packages, weight_actual):
 
 @frappe.whitelist()
 def get_deliverable(bo_detail, station):
-    result = frappe.get_all(
-        "Booking Log",
-        filters={"bo_detail": bo_detail, "station": station},
-        fields=[
-            "sum(no_of_packages) as no_of_packages",
-            "sum(weight_actual) as weight_actual",
-            "max(loading_unit) as unit",
-        ],
-    )[0]
+    result = frappe.db.get_value(
+        "Station Balance",
+        {"bo_detail": bo_detail, "station": station},
+        ["no_of_packages", "weight_actual", "loading_unit as unit"],
+        as_dict=1,
+    )
 
     if result:
         if result.get("unit") == "Packages":
@@ -554,3 +799,138 @@ def get_charges_from_template(template):
         {"charge_type": x.charge_type, "charge_amount": x.charge_amount}
         for x in doc.charges
     ]
+
+
+def set_locations(booking_orders, **values):
+    names = list(set(booking_orders))
+    if not names or not values:
+        return
+
+    BookingOrder = frappe.qb.DocType("Booking Order")
+    q = frappe.qb.update(BookingOrder)
+    for field, value in values.items():
+        if field not in ["current_station", "next_station", "last_shipping_order"]:
+            frappe.throw(f"Invalid location field: {field}")
+        q = q.set(BookingOrder[field], value)
+
+    (
+        q.set(BookingOrder.modified, frappe.utils.now())
+        .set(BookingOrder.modified_by, frappe.session.user)
+        .where(BookingOrder.name.isin(names))
+        .where(BookingOrder.docstatus == 1)
+    ).run()
+    for name in names:
+        frappe.clear_document_cache("Booking Order", name)
+
+
+def rebuild_locations(booking_orders):
+    names = list(set(booking_orders))
+    if not names:
+        return
+
+    logs = groupby(
+        "booking_order",
+        frappe.get_all(
+            "Booking Log",
+            filters={"booking_order": ("in", names)},
+            fields=["booking_order", "station", "shipping_order", "activity"],
+            order_by="posting_datetime, creation",
+        ),
+    )
+    shipping_order_names = list(
+        set(x.get("shipping_order") for rows in logs.values() for x in rows) - {None}
+    )
+    shipping_orders = (
+        {
+            x.get("name"): x
+            for x in frappe.get_all(
+                "Shipping Order",
+                filters={"name": ("in", shipping_order_names)},
+                fields=["name", "status", "current_station", "next_station"],
+            )
+        }
+        if shipping_order_names
+        else {}
+    )
+
+    def get_location(name):
+        rows = logs.get(name)
+        if not rows:
+            return None, None, None
+
+        last = rows[-1]
+        last_shipping_order = first(
+            [x.get("shipping_order") for x in reversed(rows) if x.get("shipping_order")]
+            or [None]
+        )
+        shipping_order = (
+            shipping_orders.get(last.get("shipping_order"))
+            if last.get("activity") == "Loaded"
+            else None
+        )
+        if shipping_order and shipping_order.get("status") == "In Transit":
+            return last_shipping_order, None, shipping_order.get("next_station")
+        if shipping_order and shipping_order.get("current_station"):
+            return last_shipping_order, shipping_order.get("current_station"), None
+        return last_shipping_order, last.get("station"), None
+
+    for (last_shipping_order, current_station, next_station), rows in groupby(
+        get_location, names
+    ).items():
+        set_locations(
+            rows,
+            last_shipping_order=last_shipping_order,
+            current_station=current_station,
+            next_station=next_station,
+        )
+
+
+def set_first_loads(booking_orders, shipping_order, loaded_at, overwrite=False):
+    names = list(set(booking_orders))
+    if not names:
+        return
+
+    BookingOrder = frappe.qb.DocType("Booking Order")
+    q = (
+        frappe.qb.update(BookingOrder)
+        .set(BookingOrder.first_shipping_order, shipping_order)
+        .set(BookingOrder.first_loaded_at, loaded_at)
+        .set(BookingOrder.modified, frappe.utils.now())
+        .set(BookingOrder.modified_by, frappe.session.user)
+        .where(BookingOrder.name.isin(names))
+        .where(BookingOrder.docstatus == 1)
+    )
+    if not overwrite:
+        q = q.where(
+            BookingOrder.first_loaded_at.isnull()
+            | (BookingOrder.first_loaded_at > loaded_at)
+        )
+    q.run()
+    for name in names:
+        frappe.clear_document_cache("Booking Order", name)
+
+
+def rebuild_first_loads(booking_orders):
+    names = list(set(booking_orders))
+    if not names:
+        return
+
+    first_loads = valmap(
+        first,
+        groupby(
+            "booking_order",
+            frappe.get_all(
+                "Booking Log",
+                filters={"booking_order": ("in", names), "activity": "Loaded"},
+                fields=["booking_order", "shipping_order", "posting_datetime"],
+                order_by="posting_datetime, creation",
+            ),
+        ),
+    )
+
+    def get_first_load(name):
+        load = first_loads.get(name) or {}
+        return load.get("shipping_order"), load.get("posting_datetime")
+
+    for (shipping_order, loaded_at), rows in groupby(get_first_load, names).items():
+        set_first_loads(rows, shipping_order, loaded_at, overwrite=True)
@@ -1,11 +1,13 @@
 import frappe
-from erpnext.accounts.party import get_party_account
+from frappe.query_builder.functions import IfNull, Sum
+from erpnext.accounts.party import get_party_account, get_dashboard_info
 from erpnext.accounts.utils import get_account_currency
 from erpnext.accounts.doctype.journal_entry.journal_entry import (
     get_default_bank_cash_account,
 )
 
 from gg_custom.api.booking_order import get_payment_entry_from_invoices
+from gg_custom.api.utils import get_cached_dashboard_info, clear_dashboard_info
 
 
 def get_party_open_orders(party):
@@ -23,32 +25,201 @@ def get_party_open_orders(party):
 
     booking_orders = [
         frappe.get_cached_doc("Booking Order", name)
-        for name in set([x.gg_booking_order for x in sales_invoices if x])
+        for name in set([y.gg_booking_order for x in sales_invoices for y in x.items])
+        if name
     ]
 
     return {"booking_orders": booking_orders, "sales_invoices": sales_invoices}
 
 
+def get_party_open_order_rows(party, limit=500, start=0):
+    """
+    Lean variant of get_party_open_orders for party statements. Returns only the
+    printed fields of at most limit open invoices, oldest first, with has_more
+    set when the party has further invoices after this page. Consolidated invoices
+    are returned as one row per Booking Order with their share of the amounts.
+    """
+    customer = frappe.get_cached_value("Booking Party", party, "customer")
+    if not customer:
+        return {"booking_orders": [], "sales_invoices": [], "has_more": False}
+
+    SalesInvoice = frappe.qb.DocType("Sales Invoice")
+    SalesInvoiceItem = frappe.qb.DocType("Sales Invoice Item")
+    BookingOrder = frappe.qb.DocType("Booking Order")
+    invoices = (
+        frappe.qb.from_(SalesInvoice)
+        .where((SalesInvoice.docstatus == 1) & (SalesInvoice.outstanding_amount > 0))
+        .where(SalesInvoice.customer == customer)
+        .select(
+            SalesInvoice.name,
+            SalesInvoice.posting_date,
+            SalesInvoice.due_date,
+            SalesInvoice.total,
+            SalesInvoice.grand_total,
+            SalesInvoice.outstanding_amount,
+            SalesInvoice.gg_loading_operation,
+        )
+        .orderby(SalesInvoice.posting_date)
+        .orderby(SalesInvoice.name)
+        .limit(frappe.utils.cint(limit) + 1)
+        .offset(frappe.utils.cint(start))
+    ).run(as_dict=1)
+
+    has_more = len(invoices) > frappe.utils.cint(limit)
+    invoices = invoices[: frappe.utils.cint(limit)]
+    if not invoices:
+        return {"booking_orders": [], "sales_invoices": [], "has_more": False}
+
+    amounts = {}
+    for parent, booking_order, amount in (
+        frappe.qb.from_(SalesInvoiceItem)
+        .where(SalesInvoiceItem.parent.isin([x.get("name") for x in invoices]))
+        .where(IfNull(SalesInvoiceItem.gg_booking_order, "") != "")
+        .select(
+            SalesInvoiceItem.parent,
+            SalesInvoiceItem.gg_booking_order,
+            Sum(SalesInvoiceItem.amount),
+        )
+        .groupby(SalesInvoiceItem.parent, SalesInvoiceItem.gg_booking_order)
+        .orderby(SalesInvoiceItem.parent)
+        .orderby(SalesInvoiceItem.gg_booking_order)
+    ).run():
+        amounts.setdefault(parent, []).append((booking_order, amount))
+
+    def get_rows(invoice):
+        total = frappe.utils.flt(invoice.pop("total"))
+        if not total or not amounts.get(invoice.get("name")):
+            return [frappe._dict(invoice, gg_booking_order=None)]
+
+        return [
+            frappe._dict(
+                invoice,
+                gg_booking_order=booking_order,
+                grand_total=frappe.utils.flt(invoice.grand_total * amount / total),
+                outstanding_amount=frappe.utils.flt(
+                    invoice.outstanding_amount * amount / total
+                ),
+            )
+            for booking_order, amount in amounts.get(invoice.get("name"))
+        ]
+
+    sales_invoices = [y for x in invoices for y in get_rows(x)]
+
+    booking_orders = (
+        frappe.qb.from_(SalesInvoiceItem)
+        .join(BookingOrder)
+        .on(BookingOrder.name == SalesInvoiceItem.gg_booking_order)
+        .where(SalesInvoiceItem.parent.isin([x.get("name") for x in sales_invoices]))
+        .select(
+            BookingOrder.name,
+            BookingOrder.paper_receipt_no,
+            BookingOrder.booking_datetime,
+            BookingOrder.source_station,
+            BookingOrder.destination_station,
+            BookingOrder.consignor_name,
+            BookingOrder.consignee_name,
+            BookingOrder.no_of_packages,
+            BookingOrder.weight_actual,
+            BookingOrder.total_amount,
+            BookingOrder.outstanding_total,
+            BookingOrder.status,
+            BookingOrder.payment_status,
+        )
+        .distinct()
+        .orderby(BookingOrder.booking_datetime)
+    ).run(as_dict=1)
+
+    return {
+        "booking_orders": booking_orders,
+        "sales_invoices": sales_invoices,
+        "has_more": has_more,
+    }
+
+
 @frappe.whitelist()
 def make_payment_entry(source_name, target_doc=None):
     customer = frappe.get_cached_value("Booking Party", source_name, "customer")
-    invoices = [
-        frappe.get_cached_doc("Sales Invoice", x.get("name"))
-        for x in frappe.get_all(
-            "Sales Invoice",
-            filters={
-                "docstatus": 1,
-                "customer": customer,
-                "outstanding_amount": [">", 0],
-            },
-            order_by="posting_date, name",
+    # args are passed through frappe.flags by frappe.model.mapper.make_mapped_doc
+    amount = (frappe.flags.args or {}).get("amount")
+    return allocate_payment("Customer", customer, amount=amount)
+
+
+def allocate_payment(party_type, party, amount=None, page_length=500):
+    """
+    Make a Payment Entry for party that allocates amount to its open invoices,
+    oldest first. All open invoices are allocated when amount is not set.
+    """
+    if party_type not in ["Customer", "Supplier"]:
+        frappe.throw(f"Invalid party type: {party_type}")
+
+    invoice_type = "Sales Invoice" if party_type == "Customer" else "Purchase Invoice"
+    remaining = frappe.utils.flt(amount) if amount else None
+    invoices = []
+    for invoice in _get_open_invoices(invoice_type, party, page_length):
+        if remaining is not None and remaining <= 0:
+            break
+
+        allocated_amount = (
+            min(remaining, invoice.outstanding_amount)
+            if remaining is not None
+            else invoice.outstanding_amount
         )
-    ]
+        invoices.append(frappe._dict(invoice, allocated_amount=allocated_amount))
+        if remaining is not None:
+            remaining -= allocated_amount
 
     if not invoices:
-        return get_empty_payment_entry("Customer", customer)
+        pe = get_empty_payment_entry(party_type, party)
+    else:
+        pe = get_payment_entry_from_invoices(invoice_type, invoices)
+
+    if amount and frappe.utils.flt(amount) != pe.paid_amount:
+        pe.paid_amount = frappe.utils.flt(amount)
+        pe.received_amount = frappe.utils.flt(amount)
+        if pe.paid_from and pe.paid_to:
+            pe.set_amounts()
+
+    return pe
+
+
+def _get_open_invoices(invoice_type, party, page_length):
+    # pages are keyed on (posting_date, name) so that they stay stable while
+    # streaming, unlike offsets
+    Invoice = frappe.qb.DocType(invoice_type)
+    party_field = "customer" if invoice_type == "Sales Invoice" else "supplier"
+    last = None
+    while True:
+        q = (
+            frappe.qb.from_(Invoice)
+            .where(Invoice.docstatus == 1)
+            .where(Invoice.outstanding_amount > 0)
+            .where(Invoice[party_field] == party)
+            .select(
+                Invoice.name,
+                Invoice.posting_date,
+                Invoice.due_date,
+                Invoice.grand_total,
+                Invoice.outstanding_amount,
+            )
+            .orderby(Invoice.posting_date)
+            .orderby(Invoice.name)
+            .limit(page_length)
+        )
+        if last:
+            q = q.where(
+                (Invoice.posting_date > last.posting_date)
+                | (
+                    (Invoice.posting_date == last.posting_date)
+                    & (Invoice.name > last.name)
+                )
+            )
+
+        invoices = q.run(as_dict=1)
+        yield from invoices
+        if len(invoices) < page_length:
+            return
 
-    return get_payment_entry_from_invoices("Sales Invoice", invoices)
+        last = invoices[-1]
 
 
 def get_empty_payment_entry(party_type, party):
@@ -121,3 +292,32 @@ def update_customer(name):
                     customer_field,
                     doc.get(booking_party_field),
                 )
+
+
+@frappe.whitelist()
+def get_party_dashboard_info(name):
+    frappe.has_permission("Booking Party", "read", name, throw=True)
+    return get_cached_dashboard_info(
+        "booking_party_dashboard_info", name, lambda: _get_party_dashboard_info(name)
+    )
+
+
+def clear_party_dashboard_cache(booking_parties):
+    clear_dashboard_info("booking_party_dashboard_info", booking_parties)
+
+
+def clear_customer_dashboard_cache(customers):
+    names = list(set(x for x in customers if x))
+    if names:
+        clear_party_dashboard_cache(
+            frappe.get_all(
+                "Booking Party", filters={"customer": ("in", names)}, pluck="name"
+            )
+        )
+
+
+def _get_party_dashboard_info(name):
+    customer = frappe.db.get_value("Booking Party", name, "customer")
+    if not customer:
+        return []
+    return get_dashboard_info("Customer", customer)
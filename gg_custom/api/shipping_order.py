@@ -1,8 +1,10 @@
 import frappe
 from frappe.query_builder import Criterion
-from frappe.query_builder.functions import Sum, GroupConcat
+from frappe.query_builder.functions import Coalesce, Sum, GroupConcat
 from toolz.curried import (
     compose,
+    first,
+    groupby,
     merge,
     valmap,
     keymap,
@@ -17,6 +19,7 @@ from gg_custom.api.booking_order import (
     get_freight_rates,
     get_payment_entry_from_invoices,
 )
+from gg_custom.api.utils import get_cached_dashboard_info, clear_dashboard_info
 
 
 @frappe.whitelist()
@@ -123,42 +126,62 @@ def get_history(name):
     return [get_event(x) for x in logs]
 
 
-def get_manifest_rows(shipping_order):
-    LoadingOperationBookingOrder = frappe.qb.DocType("Loading Operation Booking Order")
-    LoadingOperation = frappe.qb.DocType("Loading Operation")
-    BookingOrder = frappe.qb.DocType("Booking Order")
-    BookingOrderFreightDetail = frappe.qb.DocType("Booking Order Freight Detail")
+@frappe.whitelist()
+def get_dashboard_info(name):
+    frappe.has_permission("Shipping Order", "read", name, throw=True)
+    return get_cached_dashboard_info(
+        "shipping_order_dashboard_info", name, lambda: _get_dashboard_info(name)
+    )
 
-    return (
-        frappe.qb.from_(LoadingOperationBookingOrder)
-        .left_join(LoadingOperation)
-        .on(LoadingOperation.name == LoadingOperationBookingOrder.parent)
-        .left_join(BookingOrder)
-        .on(BookingOrder.name == LoadingOperationBookingOrder.booking_order)
-        .left_join(BookingOrderFreightDetail)
-        .on(BookingOrderFreightDetail.name == LoadingOperationBookingOrder.bo_detail)
+
+def clear_dashboard_cache(shipping_orders):
+    clear_dashboard_info("shipping_order_dashboard_info", shipping_orders)
+
+
+def _get_dashboard_info(name):
+    contents = get_order_contents(frappe.get_doc("Shipping Order", name))
+    PurchaseInvoice = frappe.qb.DocType("Purchase Invoice")
+    q = (
+        frappe.qb.from_(PurchaseInvoice)
         .where(
-            (LoadingOperation.docstatus == 1)
-            & (LoadingOperationBookingOrder.parentfield == "on_loads")
+            (PurchaseInvoice.docstatus == 1)
+            & (PurchaseInvoice.gg_shipping_order == name)
         )
-        .where(LoadingOperation.shipping_order == shipping_order)
         .select(
-            LoadingOperationBookingOrder.booking_order,
-            LoadingOperationBookingOrder.loading_unit,
-            LoadingOperationBookingOrder.qty,
-            Sum(LoadingOperationBookingOrder.no_of_packages, "cur_no_of_packages"),
-            Sum(LoadingOperationBookingOrder.weight_actual, "cur_weight_actual"),
-            GroupConcat(BookingOrderFreightDetail.item_description, "item_description"),
-            BookingOrder.destination_station,
-            BookingOrder.consignor_name,
-            BookingOrder.consignee_name,
-            BookingOrder.no_of_packages,
-            BookingOrder.weight_actual,
+            Sum(PurchaseInvoice.rounded_total, "rounded_total"),
+            Sum(PurchaseInvoice.outstanding_amount, "outstanding_amount"),
         )
-        .groupby(LoadingOperationBookingOrder.booking_order)
-        .orderby(LoadingOperation.name)
-        .orderby(LoadingOperation.idx)
-    ).run(as_dict=1)
+    )
+    invoice = q.run(as_dict=1)[0]
+
+    return {
+        **contents,
+        "invoice": invoice,
+        "history": get_history(name),
+    }
+
+
+def get_manifest_rows(shipping_order):
+    def make_row(rows):
+        row = first(rows)
+        return {
+            "booking_order": row.get("booking_order"),
+            "loading_unit": row.get("loading_unit"),
+            "qty": row.get("qty"),
+            "cur_no_of_packages": sum([x.get("no_of_packages") or 0 for x in rows]),
+            "cur_weight_actual": sum([x.get("weight_actual") or 0 for x in rows]),
+            "item_description": ",".join(
+                [x.get("item_description") for x in rows if x.get("item_description")]
+            ),
+            "destination_station": row.get("destination_station"),
+            "consignor_name": row.get("consignor_name"),
+            "consignee_name": row.get("consignee_name"),
+            "no_of_packages": row.get("booking_no_of_packages"),
+            "weight_actual": row.get("booking_weight_actual"),
+        }
+
+    grouped = groupby("booking_order", get_manifest_entries(shipping_order))
+    return [make_row(x) for x in grouped.values()]
 
 
 def get_freight_summary_rows(shipping_order):
@@ -170,106 +193,196 @@ def get_freight_summary_rows(shipping_order):
             return (row.get("cur_weight_actual") or 0) * rate
         return row.get("amount") or 0
 
-    LoadingOperationBookingOrder = frappe.qb.DocType("Loading Operation Booking Order")
-    LoadingOperation = frappe.qb.DocType("Loading Operation")
     BookingOrder = frappe.qb.DocType("Booking Order")
-    BookingOrderFreightDetail = frappe.qb.DocType("Booking Order Freight Detail")
     BookingOrderCharge = frappe.qb.DocType("Booking Order Charge")
 
-    freight_rows = (
-        frappe.qb.from_(LoadingOperationBookingOrder)
-        .left_join(LoadingOperation)
-        .on(LoadingOperation.name == LoadingOperationBookingOrder.parent)
-        .left_join(BookingOrder)
-        .on(BookingOrder.name == LoadingOperationBookingOrder.booking_order)
-        .left_join(BookingOrderFreightDetail)
-        .on(BookingOrderFreightDetail.name == LoadingOperationBookingOrder.bo_detail)
-        .where(
-            (LoadingOperation.docstatus == 1)
-            & (LoadingOperationBookingOrder.parentfield == "on_loads")
-        )
-        .where(LoadingOperation.shipping_order == shipping_order)
-        .select(
-            BookingOrder.name.as_("booking_order"),
-            BookingOrder.consignor_name,
-            BookingOrder.consignee_name,
-            BookingOrderFreightDetail.item_description,
-            Sum(LoadingOperationBookingOrder.no_of_packages, "cur_no_of_packages"),
-            Sum(LoadingOperationBookingOrder.weight_actual, "cur_weight_actual"),
-            BookingOrderFreightDetail.based_on,
-            BookingOrderFreightDetail.rate,
-        )
-        .groupby(LoadingOperationBookingOrder.name)
-        .orderby(LoadingOperation.name)
-        .orderby(LoadingOperationBookingOrder.idx)
+    freight_rows = [
+        {
+            "booking_order": x.get("booking_order"),
+            "consignor_name": x.get("consignor_name"),
+            "consignee_name": x.get("consignee_name"),
+            "item_description": x.get("item_description"),
+            "cur_no_of_packages": x.get("no_of_packages"),
+            "cur_weight_actual": x.get("weight_actual"),
+            "based_on": x.get("based_on"),
+            "rate": x.get("rate"),
+        }
+        for x in get_manifest_entries(shipping_order)
+    ]
+
+    charges_rows = [
+        {
+            **x,
+            "cur_no_of_packages": 0,
+            "cur_weight_actual": 0,
+            "based_on": "",
+            "rate": 0,
+        }
+        for x in (
+            frappe.qb.from_(BookingOrder)
+            .left_join(BookingOrderCharge)
+            .on(BookingOrderCharge.parent == BookingOrder.name)
+            .where(BookingOrder.first_shipping_order == shipping_order)
+            .where(BookingOrder.docstatus == 1)
+            .where(BookingOrderCharge.charge_amount > 0)
+            .select(
+                BookingOrder.name.as_("booking_order"),
+                BookingOrder.consignor_name,
+                BookingOrder.consignee_name,
+                GroupConcat(BookingOrderCharge.charge_type, "item_description"),
+                Sum(BookingOrderCharge.charge_amount, "amount"),
+            )
+            .groupby(BookingOrder.name)
+        ).run(as_dict=1)
+    ]
+
+    return sorted(
+        [{**x, "amount": get_amount(x)} for x in freight_rows + charges_rows],
+        key=lambda x: x.get("booking_order"),
+    )
+
+
+def get_manifest_entries(shipping_order):
+    ShippingManifestEntry = frappe.qb.DocType("Shipping Manifest Entry")
+    return (
+        frappe.qb.from_(ShippingManifestEntry)
+        .where(ShippingManifestEntry.shipping_order == shipping_order)
+        .select(ShippingManifestEntry.star)
+        .orderby(ShippingManifestEntry.loading_operation)
+        .orderby(ShippingManifestEntry.idx)
     ).run(as_dict=1)
 
-    booking_orders = set([x.get("booking_order") for x in freight_rows])
-
-    first_loaded_booking_orders = (
-        [
-            x.get("booking_order")
-            for x in (
-                frappe.qb.from_(LoadingOperationBookingOrder)
-                .left_join(LoadingOperation)
-                .on(LoadingOperation.name == LoadingOperationBookingOrder.parent)
-                .left_join(BookingOrderCharge)
-                .on(
-                    BookingOrderCharge.parent
-                    == LoadingOperationBookingOrder.booking_order
-                )
-                .where(
-                    (LoadingOperation.docstatus == 1)
-                    & (LoadingOperationBookingOrder.parentfield == "on_loads")
-                )
-                .where(LoadingOperationBookingOrder.booking_order.isin(booking_orders))
-                .select(
-                    LoadingOperationBookingOrder.booking_order,
-                    LoadingOperation.shipping_order,
+
+manifest_fields = [
+    "shipping_order",
+    "loading_operation",
+    "posting_datetime",
+    "booking_order",
+    "bo_detail",
+    "destination_station",
+    "consignor_name",
+    "consignee_name",
+    "item_description",
+    "based_on",
+    "rate",
+    "loading_unit",
+    "qty",
+    "no_of_packages",
+    "weight_actual",
+    "booking_no_of_packages",
+    "booking_weight_actual",
+]
+
+
+def insert_manifest_entries(doc):
+    if not doc.on_loads:
+        return
+
+    BookingOrder = frappe.qb.DocType("Booking Order")
+    BookingOrderFreightDetail = frappe.qb.DocType("Booking Order Freight Detail")
+    details = {
+        x.get("bo_detail"): x
+        for x in (
+            frappe.qb.from_(BookingOrderFreightDetail)
+            .left_join(BookingOrder)
+            .on(BookingOrder.name == BookingOrderFreightDetail.parent)
+            .where(
+                BookingOrderFreightDetail.name.isin(
+                    list(set(x.bo_detail for x in doc.on_loads))
                 )
-                .groupby(LoadingOperationBookingOrder.booking_order)
-                .having(LoadingOperation.shipping_order == shipping_order)
-                .orderby(LoadingOperation.posting_datetime)
-            ).run(as_dict=1)
-        ]
-        if booking_orders
-        else []
-    )
+            )
+            .select(
+                BookingOrderFreightDetail.name.as_("bo_detail"),
+                BookingOrderFreightDetail.item_description,
+                BookingOrderFreightDetail.based_on,
+                BookingOrderFreightDetail.rate,
+                BookingOrder.destination_station,
+                BookingOrder.consignor_name,
+                BookingOrder.consignee_name,
+                BookingOrder.no_of_packages.as_("booking_no_of_packages"),
+                BookingOrder.weight_actual.as_("booking_weight_actual"),
+            )
+        ).run(as_dict=1)
+    }
 
-    charges_rows = (
-        [
+    def make_entry(load):
+        return merge(
+            details.get(load.bo_detail) or {},
             {
-                **x,
-                "cur_no_of_packages": 0,
-                "cur_weight_actual": 0,
-                "based_on": "",
-                "rate": 0,
-            }
-            for x in (
-                (
-                    frappe.qb.from_(BookingOrder)
-                    .left_join(BookingOrderCharge)
-                    .on(BookingOrderCharge.parent == BookingOrder.name)
-                    .where(BookingOrder.name.isin(first_loaded_booking_orders))
-                    .where(BookingOrderCharge.charge_amount > 0)
-                    .select(
-                        BookingOrder.name.as_("booking_order"),
-                        BookingOrder.consignor_name,
-                        BookingOrder.consignee_name,
-                        GroupConcat(BookingOrderCharge.charge_type, "item_description"),
-                        Sum(BookingOrderCharge.charge_amount, "amount"),
-                    )
-                    .groupby(BookingOrder.name)
-                )
-            ).run(as_dict=1)
-        ]
-        if first_loaded_booking_orders
-        else []
+                "shipping_order": doc.shipping_order,
+                "loading_operation": doc.name,
+                "posting_datetime": doc.posting_datetime,
+                "booking_order": load.booking_order,
+                "bo_detail": load.bo_detail,
+                "loading_unit": load.loading_unit,
+                "qty": load.qty,
+                "no_of_packages": load.no_of_packages,
+                "weight_actual": load.weight_actual,
+            },
+        )
+
+    now = frappe.utils.now()
+    user = frappe.session.user
+    frappe.db.bulk_insert(
+        "Shipping Manifest Entry",
+        fields=["name", "creation", "modified", "owner", "modified_by", "idx"]
+        + manifest_fields,
+        values=[
+            [x.name, now, now, user, user, x.idx]
+            + [make_entry(x).get(field) for field in manifest_fields]
+            for x in doc.on_loads
+        ],
     )
 
-    return sorted(
-        [{**x, "amount": get_amount(x)} for x in freight_rows + charges_rows],
-        key=lambda x: x.get("booking_order"),
+
+def delete_manifest_entries(filters):
+    frappe.db.delete("Shipping Manifest Entry", filters)
+
+
+def rebuild_manifest_entries():
+    frappe.db.delete("Shipping Manifest Entry")
+    frappe.db.sql(
+        """
+            INSERT INTO `tabShipping Manifest Entry` (
+                name, creation, modified, owner, modified_by, idx,
+                {fields}
+            )
+            SELECT
+                lobo.name,
+                NOW(),
+                NOW(),
+                'Administrator',
+                'Administrator',
+                lobo.idx,
+                lo.shipping_order,
+                lo.name,
+                lo.posting_datetime,
+                lobo.booking_order,
+                lobo.bo_detail,
+                bo.destination_station,
+                bo.consignor_name,
+                bo.consignee_name,
+                bofd.item_description,
+                bofd.based_on,
+                bofd.rate,
+                lobo.loading_unit,
+                lobo.qty,
+                lobo.no_of_packages,
+                lobo.weight_actual,
+                bo.no_of_packages,
+                bo.weight_actual
+            FROM `tabLoading Operation Booking Order` AS lobo
+            LEFT JOIN `tabLoading Operation` AS lo ON lo.name = lobo.parent
+            LEFT JOIN `tabBooking Order` AS bo ON bo.name = lobo.booking_order
+            LEFT JOIN `tabBooking Order Freight Detail` AS bofd ON
+                bofd.name = lobo.bo_detail
+            WHERE
+                lo.docstatus = 1 AND
+                lobo.parenttype = 'Loading Operation' AND
+                lobo.parentfield = 'on_loads'
+        """.format(
+            fields=", ".join(manifest_fields)
+        )
     )
 
 
@@ -361,21 +474,15 @@ def make_purchase_invoice(source_name, target_doc=None, posting_datetime=None):
     )
 
 
+load_params = ["no_of_packages", "weight_actual", "goods_value"]
+load_fields = [f"{t}_{p}" for p in load_params for t in ["on_load", "off_load"]]
+
+
 def get_order_contents(doc):
-    LoadingOperation = frappe.qb.DocType("Loading Operation")
-    params = ["no_of_packages", "weight_actual", "goods_value"]
-    fieldnames = [f"{t}_{p}" for p in params for t in ["on_load", "off_load"]]
-    data = (
-        frappe.qb.from_(LoadingOperation)
-        .where(LoadingOperation.docstatus == 1)
-        .where(LoadingOperation.shipping_order == doc.name)
-        .select(
-            *[Sum(LoadingOperation[x]).as_(x) for x in fieldnames],
-        )
-    ).run(as_dict=1)[0]
+    data = {x: doc.get(x) for x in load_fields}
 
     def get_values(_type):
-        fields = list(map(lambda x: "{}_{}".format(_type, x), params))
+        fields = list(map(lambda x: "{}_{}".format(_type, x), load_params))
         _get = compose(
             valmap(lambda x: x or 0),
             keymap(lambda x: x.replace("{}_".format(_type), "")),
@@ -386,7 +493,7 @@ def get_order_contents(doc):
     on_load = get_values("on_load")
     off_load = get_values("off_load")
 
-    current = merge({}, *[{x: on_load[x] - off_load[x]} for x in params])
+    current = merge({}, *[{x: on_load[x] - off_load[x]} for x in load_params])
 
     return {
         "on_load": on_load,
@@ -395,6 +502,149 @@ def get_order_contents(doc):
     }
 
 
+def update_load_totals(shipping_order, loads, reverse=False):
+    if not shipping_order or not loads:
+        return
+
+    booking_orders = {
+        x.get("name"): x
+        for x in frappe.get_all(
+            "Booking Order",
+            filters={"name": ("in", list(set(x.get("booking_order") for x in loads)))},
+            fields=["name", "goods_value", "no_of_packages", "weight_actual"],
+        )
+    }
+
+    def get_goods_value(load):
+        booking_order = booking_orders.get(load.get("booking_order")) or {}
+        return (booking_order.get("goods_value") or 0) * _get_load_share(
+            load, booking_order
+        )
+
+    def get_direction(load):
+        if load.get("parentfield") not in ["on_loads", "off_loads"]:
+            frappe.throw(frappe._("Invalid Loading Operation load"))
+        return load.get("parentfield")[:-1]
+
+    sign = -1 if reverse else 1
+    deltas = {x: 0 for x in load_fields}
+    for load in loads:
+        direction = get_direction(load)
+        for param in ["no_of_packages", "weight_actual"]:
+            deltas[f"{direction}_{param}"] += sign * (load.get(param) or 0)
+        deltas[f"{direction}_goods_value"] += sign * get_goods_value(load)
+
+    ShippingOrder = frappe.qb.DocType("Shipping Order")
+    q = frappe.qb.update(ShippingOrder)
+    for field, delta in deltas.items():
+        q = q.set(ShippingOrder[field], Coalesce(ShippingOrder[field], 0) + delta)
+    q.where(ShippingOrder.name == shipping_order).run()
+    frappe.clear_document_cache("Shipping Order", shipping_order)
+    clear_dashboard_cache([shipping_order])
+
+
+def _get_load_share(load, booking_order):
+    # goods value is not recorded per load, so it follows the share of the order
+    if booking_order.get("no_of_packages"):
+        return (load.get("no_of_packages") or 0) / booking_order.get("no_of_packages")
+    if booking_order.get("weight_actual"):
+        return (load.get("weight_actual") or 0) / booking_order.get("weight_actual")
+    return 0
+
+
+def get_load_totals(shipping_orders=None):
+    conditions = ["lo.docstatus = 1"]
+    if shipping_orders is not None:
+        if not shipping_orders:
+            return {}
+        conditions.append("lo.shipping_order IN %(shipping_orders)s")
+
+    rows = frappe.db.sql(
+        """
+            SELECT
+                lo.shipping_order,
+                lobo.parentfield,
+                SUM(lobo.no_of_packages) AS no_of_packages,
+                SUM(lobo.weight_actual) AS weight_actual,
+                SUM(
+                    IFNULL(bo.goods_value, 0) * CASE
+                        WHEN IFNULL(bo.no_of_packages, 0) != 0
+                            THEN lobo.no_of_packages / bo.no_of_packages
+                        WHEN IFNULL(bo.weight_actual, 0) != 0
+                            THEN lobo.weight_actual / bo.weight_actual
+                        ELSE 0
+                    END
+                ) AS goods_value
+            FROM `tabLoading Operation Booking Order` AS lobo
+            LEFT JOIN `tabLoading Operation` AS lo ON lo.name = lobo.parent
+            LEFT JOIN `tabBooking Order` AS bo ON bo.name = lobo.booking_order
+            WHERE
+                lobo.parenttype = 'Loading Operation' AND
+                lobo.parentfield IN ('on_loads', 'off_loads') AND
+                {conditions}
+            GROUP BY lo.shipping_order, lobo.parentfield
+        """.format(
+            conditions=" AND ".join(conditions)
+        ),
+        values={"shipping_orders": tuple(shipping_orders or [])},
+        as_dict=1,
+    )
+
+    totals = {}
+    for row in rows:
+        direction = row.get("parentfield")[:-1]
+        totals.setdefault(row.get("shipping_order"), {x: 0 for x in load_fields})
+        for param in load_params:
+            totals[row.get("shipping_order")][f"{direction}_{param}"] = (
+                row.get(param) or 0
+            )
+
+    return totals
+
+
+def verify_load_totals(shipping_orders=None):
+    filters = {"docstatus": 1}
+    if shipping_orders is not None:
+        filters["name"] = ("in", shipping_orders)
+    totals = get_load_totals(shipping_orders)
+
+    drifts = []
+    for doc in frappe.get_all(
+        "Shipping Order", filters=filters, fields=["name"] + load_fields
+    ):
+        expected = totals.get(doc.get("name")) or {x: 0 for x in load_fields}
+        for field in load_fields:
+            stored = doc.get(field) or 0
+            if frappe.utils.flt(stored - expected[field], 3):
+                drifts.append(
+                    frappe._dict(
+                        shipping_order=doc.get("name"),
+                        field=field,
+                        stored=stored,
+                        expected=expected[field],
+                    )
+                )
+
+    return drifts
+
+
+def rebuild_load_totals(shipping_orders=None):
+    filters = {"docstatus": 1}
+    if shipping_orders is not None:
+        filters["name"] = ("in", shipping_orders)
+    totals = get_load_totals(shipping_orders)
+
+    ShippingOrder = frappe.qb.DocType("Shipping Order")
+    for name in frappe.get_all("Shipping Order", filters=filters, pluck="name"):
+        values = totals.get(name) or {x: 0 for x in load_fields}
+        q = frappe.qb.update(ShippingOrder)
+        for field, value in values.items():
+            q = q.set(ShippingOrder[field], value)
+        q.where(ShippingOrder.name == name).run()
+        frappe.clear_document_cache("Shipping Order", name)
+        clear_dashboard_cache([name])
+
+
 @frappe.whitelist()
 def get_charges_from_template(template):
     if not template:
@@ -0,0 +1,21 @@
+import frappe
+
+
+# cached dashboards are also cleared by doc events, the expiry covers changes
+# that have no hook here, like Journal Entries and fiscal year roll overs
+dashboard_cache_ttl = 600
+
+
+def get_cached_dashboard_info(key, name, generator):
+    cache_key = f"{key}:{name}"
+    value = frappe.cache().get_value(cache_key)
+    if value is None:
+        value = generator()
+        frappe.cache().set_value(cache_key, value, expires_in_sec=dashboard_cache_ttl)
+    return value
+
+
+def clear_dashboard_info(key, names):
+    for name in set(names):
+        if name:
+            frappe.cache().delete_value(f"{key}:{name}")
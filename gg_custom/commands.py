@@ -0,0 +1,49 @@
+import click
+import frappe
+from frappe.commands import get_site, pass_context
+
+
+@click.command("verify-shipping-order-totals")
+@click.option("--shipping-order", multiple=True, help="Shipping Order(s) to verify")
+@click.option("--fix", is_flag=True, default=False, help="Rebuild drifted totals")
+@pass_context
+def verify_shipping_order_totals(context, shipping_order=None, fix=False):
+    "Recompute the load totals of Shipping Orders and report any drift"
+    from gg_custom.api.shipping_order import verify_load_totals, rebuild_load_totals
+
+    frappe.init(site=get_site(context))
+    frappe.connect()
+    try:
+        drifts = verify_load_totals(list(shipping_order) if shipping_order else None)
+        for drift in drifts:
+            click.echo(
+                "{shipping_order}: {field} is {stored}, expected {expected}".format(
+                    **drift
+                )
+            )
+
+        if not drifts:
+            click.secho("No drift found", fg="green")
+            return
+
+        if fix:
+            rebuild_load_totals(list(set(x.shipping_order for x in drifts)))
+            frappe.db.commit()
+            click.secho(
+                "Rebuilt totals for {} Shipping Order(s)".format(
+                    len(set(x.shipping_order for x in drifts))
+                ),
+                fg="green",
+            )
+        else:
+            click.secho(
+                "{} drifted total(s) found, run with --fix to rebuild".format(
+                    len(drifts)
+                ),
+                fg="yellow",
+            )
+    finally:
+        frappe.destroy()
+
+
+commands = [verify_shipping_order_totals]
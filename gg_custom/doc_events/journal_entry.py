@@ -0,0 +1,53 @@
+import frappe
+
+from gg_custom.api.booking_party import clear_customer_dashboard_cache
+from gg_custom.doc_events.sales_invoice import (
+    get_invoice_booking_orders,
+    refresh_billing_totals,
+)
+
+
+def on_submit(doc, method):
+    _update_booking_orders(doc)
+    _clear_dashboard_caches(doc)
+
+
+def on_cancel(doc, method):
+    _update_booking_orders(doc)
+    _clear_dashboard_caches(doc)
+
+
+def on_update_after_submit(doc, method):
+    # see payment_entry.on_update_after_submit
+    booking_orders = _get_booking_orders(doc)
+    if booking_orders:
+        frappe.enqueue(
+            "gg_custom.doc_events.sales_invoice.refresh_billing_totals",
+            enqueue_after_commit=True,
+            booking_orders=booking_orders,
+        )
+    _clear_dashboard_caches(doc)
+
+
+def _update_booking_orders(doc):
+    refresh_billing_totals(_get_booking_orders(doc))
+
+
+def _get_booking_orders(doc):
+    return get_invoice_booking_orders(
+        list(
+            set(
+                [
+                    x.reference_name
+                    for x in doc.accounts
+                    if x.reference_type == "Sales Invoice" and x.reference_name
+                ]
+            )
+        )
+    )
+
+
+def _clear_dashboard_caches(doc):
+    clear_customer_dashboard_cache(
+        [x.party for x in doc.accounts if x.party_type == "Customer"]
+    )
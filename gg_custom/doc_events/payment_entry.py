@@ -1,41 +1,64 @@
 import frappe
-from toolz.curried import compose, unique, map, filter
+
+from gg_custom.api.booking_party import clear_customer_dashboard_cache
+from gg_custom.api.shipping_order import clear_dashboard_cache
+from gg_custom.doc_events.sales_invoice import (
+    get_invoice_booking_orders,
+    refresh_billing_totals,
+)
 
 
 def on_submit(doc, method):
-    _update_booking_orders(
-        [x for x in doc.references if x.reference_doctype == "Sales Invoice"]
-    )
+    refresh_billing_totals(_get_booking_orders(doc.references))
+    _clear_dashboard_caches(doc)
 
 
 def on_cancel(doc, method):
-    _update_booking_orders(
-        [x for x in doc.references if x.reference_doctype == "Sales Invoice"]
-    )
+    refresh_billing_totals(_get_booking_orders(doc.references))
+    _clear_dashboard_caches(doc)
+
+
+def on_update_after_submit(doc, method):
+    # Payment Reconciliation saves the re-allocated references before it updates
+    # the invoice outstanding amounts, so the totals can only be set after commit
+    booking_orders = _get_booking_orders(doc.references)
+    if booking_orders:
+        frappe.enqueue(
+            "gg_custom.doc_events.sales_invoice.refresh_billing_totals",
+            enqueue_after_commit=True,
+            booking_orders=booking_orders,
+        )
+    _clear_dashboard_caches(doc)
 
 
-def _update_booking_orders(references):
-    get_booking_orders = compose(
-        map(lambda x: frappe.get_doc("Booking Order", x)),
-        filter(None),
-        unique,
-        map(
-            lambda x: frappe.get_cached_value(
-                "Sales Invoice", x.reference_name, "gg_booking_order"
+def _get_booking_orders(references):
+    return get_invoice_booking_orders(
+        list(
+            set(
+                [
+                    x.reference_name
+                    for x in references
+                    if x.reference_doctype == "Sales Invoice"
+                ]
             )
-        ),
-    )
-    for bo in get_booking_orders(references):
-        invoices = frappe.get_all(
-            "Sales Invoice",
-            filters={"docstatus": 1, "gg_booking_order": bo.name},
-            fields=["total", "outstanding_amount"],
         )
-        if sum([x.get("total") for x in invoices]) < bo.total_amount:
-            bo.payment_status = "Unbilled"
-        elif sum([x.get("outstanding_amount") for x in invoices]) == 0:
-            bo.payment_status = "Paid"
-        else:
-            bo.payment_status = "Unpaid"
-        bo.save()
+    )
+
 
+def _clear_dashboard_caches(doc):
+    if doc.party_type == "Customer":
+        clear_customer_dashboard_cache([doc.party])
+
+    purchase_invoices = [
+        x.reference_name
+        for x in doc.references
+        if x.reference_doctype == "Purchase Invoice"
+    ]
+    if purchase_invoices:
+        clear_dashboard_cache(
+            frappe.get_all(
+                "Purchase Invoice",
+                filters={"name": ("in", purchase_invoices)},
+                pluck="gg_shipping_order",
+            )
+        )
@@ -1,5 +1,7 @@
 import frappe
 
+from gg_custom.api.shipping_order import clear_dashboard_cache
+
 
 def validate(doc, method):
     if doc.gg_shipping_order and frappe.db.exists(
@@ -16,4 +18,12 @@ def validate(doc, method):
                     frappe.get_desk_link("Shipping Order", doc.gg_shipping_order)
                 )
             )
-        )
\ No newline at end of file
+        )
+
+
+def on_submit(doc, method):
+    clear_dashboard_cache([doc.gg_shipping_order])
+
+
+def on_cancel(doc, method):
+    clear_dashboard_cache([doc.gg_shipping_order])
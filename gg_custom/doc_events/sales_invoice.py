@@ -1,15 +1,26 @@
 import frappe
-from frappe.query_builder.functions import Count, IfNull
+from frappe.query_builder.functions import Count, IfNull, Sum
 from toolz.curried import (
     compose,
     first,
     excepts,
+    groupby,
     map,
     filter,
+    unique,
+    valmap,
+    merge,
 )
 
+from gg_custom.api.booking_order import (
+    get_loading_conversion_factor,
+    clear_dashboard_cache,
+)
+from gg_custom.api.booking_party import clear_customer_dashboard_cache
+
 
 def validate(doc, method):
+    _set_item_booking_orders(doc)
     validate_invoice(doc)
 
 
@@ -17,16 +28,10 @@ def validate_invoice(doc, throw=True):
     if doc.flags.skip_validation:
         return None
 
-    def get_error_type():
+    def get_error_type(booking_order):
         if doc.gg_loading_operation:
-            existing = frappe.db.exists(
-                "Sales Invoice",
-                {
-                    "name": ("!=", doc.name),
-                    "docstatus": 1,
-                    "gg_booking_order": doc.gg_booking_order,
-                    "gg_loading_operation": doc.gg_loading_operation,
-                },
+            existing = get_freight_invoices(
+                doc.gg_loading_operation, [booking_order], exclude=doc.name
             )
             if existing:
                 return "freight"
@@ -37,7 +42,7 @@ def validate_invoice(doc, throw=True):
                 .where(SalesInvoice.docstatus == 1)
                 .where(
                     (SalesInvoice.name != doc.name)
-                    & (SalesInvoice.gg_booking_order == doc.gg_booking_order)
+                    & (SalesInvoice.gg_booking_order == booking_order)
                     & (IfNull(SalesInvoice.gg_loading_operation, "") == "")
                 )
                 .select(Count(SalesInvoice.name))
@@ -46,20 +51,16 @@ def validate_invoice(doc, throw=True):
                 return "charges"
         return None
 
-    if doc.gg_booking_order:
-        error_type = get_error_type()
-        if error_type:
-            msg = frappe._(
-                "Sales Invoice for {} already exists for {}. ".format(
-                    error_type,
-                    frappe.get_desk_link("Booking Order", doc.gg_booking_order),
-                )
-                + "If you want to proceed, please cancel the previous Invoice."
-            )
-            if throw:
-                frappe.throw(msg)
+    booking_orders = get_booking_orders(doc)
+    if booking_orders:
+        for booking_order in booking_orders:
+            error_type = get_error_type(booking_order)
+            if error_type:
+                msg = _get_existing_invoice_message(error_type, booking_order)
+                if throw:
+                    frappe.throw(msg)
 
-            return msg
+                return msg
 
         if doc.flags.validate_loading and doc.gg_loading_operation:
             msg = _validate_freight_qty(doc)
@@ -72,52 +73,396 @@ def validate_invoice(doc, throw=True):
     return None
 
 
-def on_submit(doc, method):
-    if doc.gg_booking_order:
-        _update_booking_order(doc, is_charge=not doc.gg_loading_operation)
+def validate_freight_loads(loading_operation, loads):
+    booking_orders = list(set(x.get("booking_order") for x in loads))
+    if not booking_orders:
+        return []
 
+    invoiced_booking_orders = get_freight_invoices(loading_operation, booking_orders)
 
-def on_cancel(doc, method):
+    bo_details = list(set(x.get("bo_detail") for x in loads))
+    freight_rows = _get_freight_rows(bo_details)
+    invoiced_qtys = _get_invoiced_qtys(bo_details)
+
+    def get_error(booking_order, rows):
+        if booking_order in invoiced_booking_orders:
+            return _get_existing_invoice_message("freight", booking_order)
+
+        for row in rows:
+            freight_row = freight_rows.get(row.get("bo_detail"))
+            if not freight_row or freight_row.get("parent") != booking_order:
+                return frappe._(
+                    "Invalid Booking Order Freight Detail found in row #{} for {}".format(
+                        row.get("idx"),
+                        frappe.get_desk_link("Booking Order", booking_order),
+                    )
+                )
+
+            conversion_factor = get_loading_conversion_factor(
+                row.get("qty"),
+                row.get("loading_unit"),
+                freight_row.get("no_of_packages"),
+                freight_row.get("weight_actual"),
+            )
+            qty = _get_freight_qty(freight_row) * (conversion_factor or 0)
+            if frappe.utils.flt(
+                invoiced_qtys.get(row.get("bo_detail"), 0) + qty, precision=3
+            ) > _get_freight_qty(freight_row):
+                return _get_exceeded_freight_qty_message(booking_order)
+
+        return None
+
+    return [
+        x
+        for x in [
+            get_error(booking_order, rows)
+            for booking_order, rows in groupby("booking_order", loads).items()
+        ]
+        if x
+    ]
+
+
+def get_booking_orders(doc):
+    return list(
+        unique(
+            [x.gg_booking_order for x in doc.items if x.gg_booking_order]
+            + ([doc.gg_booking_order] if doc.gg_booking_order else [])
+        )
+    )
+
+
+def get_freight_invoices(loading_operation, booking_orders, exclude=None):
+    if not booking_orders:
+        return {}
+
+    SalesInvoice = frappe.qb.DocType("Sales Invoice")
+    SalesInvoiceItem = frappe.qb.DocType("Sales Invoice Item")
+    q = (
+        frappe.qb.from_(SalesInvoiceItem)
+        .join(SalesInvoice)
+        .on(SalesInvoice.name == SalesInvoiceItem.parent)
+        .where(SalesInvoice.docstatus == 1)
+        .where(SalesInvoice.gg_loading_operation == loading_operation)
+        .where(SalesInvoiceItem.gg_booking_order.isin(booking_orders))
+        .select(SalesInvoiceItem.gg_booking_order, SalesInvoice.name)
+        .distinct()
+    )
+    if exclude:
+        q = q.where(SalesInvoice.name != exclude)
+
+    return {booking_order: name for booking_order, name in q.run()}
+
+
+def get_billing_totals(booking_orders):
+    """
+    Invoiced amounts of each Booking Order. Consolidated invoices are shared out
+    to their Booking Orders in proportion to the item amounts.
+    """
+    if not booking_orders:
+        return {}
+
+    return {
+        x.get("booking_order"): x
+        for x in frappe.db.sql(
+            """
+                SELECT
+                    sii.gg_booking_order AS booking_order,
+                    SUM(sii.amount) AS total,
+                    SUM(sii.amount * si.grand_total / si.total) AS grand_total,
+                    SUM(
+                        sii.amount * si.outstanding_amount / si.total
+                    ) AS outstanding_amount
+                FROM `tabSales Invoice Item` AS sii
+                JOIN `tabSales Invoice` AS si ON si.name = sii.parent
+                WHERE
+                    si.docstatus = 1 AND
+                    sii.gg_booking_order IN %(booking_orders)s
+                GROUP BY sii.gg_booking_order
+            """,
+            values={"booking_orders": booking_orders},
+            as_dict=1,
+        )
+    }
+
+
+def _set_item_booking_orders(doc):
     if doc.gg_booking_order:
+        for item in doc.items:
+            if not item.gg_booking_order:
+                item.gg_booking_order = doc.gg_booking_order
+
+
+def _get_existing_invoice_message(error_type, booking_order):
+    return frappe._(
+        "Sales Invoice for {} already exists for {}. ".format(
+            error_type,
+            frappe.get_desk_link("Booking Order", booking_order),
+        )
+        + "If you want to proceed, please cancel the previous Invoice."
+    )
+
+
+def _get_exceeded_freight_qty_message(booking_order):
+    return frappe._(
+        "Total Qty will exceed Freight Qty declared in {}".format(
+            frappe.get_desk_link("Booking Order", booking_order),
+        )
+    )
+
+
+def _get_freight_rows(bo_details):
+    if not bo_details:
+        return {}
+
+    BookingOrderFreightDetail = frappe.qb.DocType("Booking Order Freight Detail")
+    return {
+        x.get("name"): x
+        for x in (
+            frappe.qb.from_(BookingOrderFreightDetail)
+            .where(BookingOrderFreightDetail.name.isin(bo_details))
+            .select(
+                BookingOrderFreightDetail.name,
+                BookingOrderFreightDetail.parent,
+                BookingOrderFreightDetail.based_on,
+                BookingOrderFreightDetail.no_of_packages,
+                BookingOrderFreightDetail.weight_actual,
+            )
+        ).run(as_dict=1)
+    }
+
+
+def _get_invoiced_qtys(bo_details):
+    if not bo_details:
+        return {}
+
+    SalesInvoiceItem = frappe.qb.DocType("Sales Invoice Item")
+    return {
+        bo_detail: qty or 0
+        for bo_detail, qty in (
+            frappe.qb.from_(SalesInvoiceItem)
+            .where(SalesInvoiceItem.docstatus == 1)
+            .where(SalesInvoiceItem.gg_bo_detail.isin(bo_details))
+            .select(SalesInvoiceItem.gg_bo_detail, Sum(SalesInvoiceItem.qty))
+            .groupby(SalesInvoiceItem.gg_bo_detail)
+        ).run()
+    }
+
+
+def on_submit(doc, method):
+    for booking_order in get_booking_orders(doc):
         _update_booking_order(
-            doc, is_charge=not doc.gg_loading_operation, is_cancel=True
+            doc, booking_order, is_charge=not doc.gg_loading_operation
         )
+    _update_billing_totals(doc)
+    clear_customer_dashboard_cache([doc.customer])
 
 
-def _update_booking_order(si, is_charge=False, is_cancel=False):
-    bo = frappe.get_cached_doc("Booking Order", si.gg_booking_order)
-    if bo.docstatus == 2:
+def on_cancel(doc, method):
+    _update_billing_totals(doc, reverse=True)
+    clear_customer_dashboard_cache([doc.customer])
+
+
+def _update_billing_totals(doc, reverse=False):
+    # returns are allocated against the outstanding of the original invoice which
+    # may be shared out differently, so recompute the Booking Orders of both
+    if doc.is_return and doc.return_against:
+        return refresh_billing_totals(
+            get_invoice_booking_orders([doc.name, doc.return_against])
+        )
+
+    update_billing_totals(_get_invoice_deltas(doc, reverse=reverse))
+
+
+def update_billing_totals(deltas):
+    """
+    Apply {booking_order: {"billed_total": ..., "outstanding_total": ...}} deltas
+    and set payment_status from the updated running totals
+    """
+    if not deltas:
         return
 
-    invoices = frappe.get_all(
-        "Sales Invoice",
-        filters={"docstatus": 1, "gg_booking_order": si.gg_booking_order},
-        fields=["name", "total", "outstanding_amount"],
+    names = list(deltas.keys())
+    frappe.db.sql(
+        """
+            UPDATE `tabBooking Order` AS bo
+            JOIN ({deltas}) AS delta ON delta.name = bo.name
+            SET
+                bo.billed_total = IFNULL(bo.billed_total, 0) + delta.billed_total,
+                bo.outstanding_total = (
+                    IFNULL(bo.outstanding_total, 0) + delta.outstanding_total
+                ),
+                bo.modified = %s,
+                bo.modified_by = %s
+            WHERE bo.docstatus = 1
+        """.format(
+            deltas=" UNION ALL ".join(
+                ["SELECT %s AS name, %s AS billed_total, %s AS outstanding_total"]
+                * len(names)
+            )
+        ),
+        values=[
+            y
+            for name in names
+            for y in [
+                name,
+                deltas[name].get("billed_total") or 0,
+                deltas[name].get("outstanding_total") or 0,
+            ]
+        ]
+        + [frappe.utils.now(), frappe.session.user],
     )
-    if sum([x.get("total") for x in invoices]) < bo.total_amount:
-        bo.payment_status = "Unbilled"
-    elif sum([x.get("outstanding_amount") for x in invoices]) == 0:
-        bo.payment_status = "Paid"
-    else:
-        bo.payment_status = "Unpaid"
-
-    if not is_cancel:
-        if is_charge:
-            _update_charges(bo)
-        else:
-            _update_freight(bo, si)
-        bo.set_totals()
-        bo.flags.ignore_validate_update_after_submit = True
+    _set_payment_status(names)
+    for name in names:
+        frappe.clear_document_cache("Booking Order", name)
+    clear_dashboard_cache(names)
+
+
+def refresh_billing_totals(booking_orders):
+    """
+    Recompute the running totals of Booking Orders from their submitted invoices.
+    Used where invoice outstanding amounts change by allocations that are not
+    known to the invoice itself, eg. returns and journal entries.
+    """
+    names = list(set(booking_orders or []))
+    if not names:
+        return
+
+    _set_billing_totals(names)
+    _set_payment_status(names)
+    for name in names:
+        frappe.clear_document_cache("Booking Order", name)
+    clear_dashboard_cache(names)
+
+
+def rebuild_billing_totals():
+    _set_billing_totals()
+    _set_payment_status()
+
+
+def get_invoice_booking_orders(invoices):
+    if not invoices:
+        return []
+
+    SalesInvoiceItem = frappe.qb.DocType("Sales Invoice Item")
+    return [
+        booking_order
+        for booking_order, in (
+            frappe.qb.from_(SalesInvoiceItem)
+            .where(SalesInvoiceItem.parent.isin(invoices))
+            .where(IfNull(SalesInvoiceItem.gg_booking_order, "") != "")
+            .select(SalesInvoiceItem.gg_booking_order)
+            .distinct()
+        ).run()
+    ]
+
+
+def _set_billing_totals(booking_orders=None):
+    frappe.db.sql(
+        """
+            UPDATE `tabBooking Order` AS bo
+            LEFT JOIN (
+                SELECT
+                    sii.gg_booking_order AS booking_order,
+                    SUM(sii.amount) AS total,
+                    SUM(
+                        sii.amount * si.outstanding_amount / si.total
+                    ) AS outstanding_amount
+                FROM `tabSales Invoice Item` AS sii
+                JOIN `tabSales Invoice` AS si ON si.name = sii.parent
+                WHERE
+                    si.docstatus = 1 AND
+                    {item_conditions}
+                GROUP BY sii.gg_booking_order
+            ) AS billing ON billing.booking_order = bo.name
+            SET
+                bo.billed_total = IFNULL(billing.total, 0),
+                bo.outstanding_total = IFNULL(billing.outstanding_amount, 0)
+            WHERE {conditions}
+        """.format(
+            item_conditions="sii.gg_booking_order IN %(booking_orders)s"
+            if booking_orders
+            else "IFNULL(sii.gg_booking_order, '') != ''",
+            conditions="bo.docstatus = 1 AND bo.name IN %(booking_orders)s"
+            if booking_orders
+            else "bo.docstatus = 1",
+        ),
+        values={"booking_orders": booking_orders},
+    )
+
+
+def _set_payment_status(booking_orders=None):
+    frappe.db.sql(
+        """
+            UPDATE `tabBooking Order` SET
+                payment_status = CASE
+                    WHEN billed_total < total_amount THEN 'Unbilled'
+                    WHEN ROUND(outstanding_total, 2) = 0 THEN 'Paid'
+                    ELSE 'Unpaid'
+                END
+            WHERE {conditions}
+        """.format(
+            conditions="docstatus = 1 AND name IN %(booking_orders)s"
+            if booking_orders
+            else "docstatus = 1"
+        ),
+        values={"booking_orders": booking_orders},
+    )
+
+
+def _get_invoice_deltas(doc, reverse=False):
+    sign = -1 if reverse else 1
+    amounts = valmap(
+        lambda rows: sum([x.amount for x in rows]),
+        groupby(
+            lambda x: x.gg_booking_order,
+            [x for x in doc.items if x.gg_booking_order],
+        ),
+    )
+    return {
+        booking_order: {
+            "billed_total": sign * amount,
+            "outstanding_total": sign
+            * frappe.utils.flt(amount * doc.outstanding_amount / doc.total)
+            if doc.total
+            else 0,
+        }
+        for booking_order, amount in amounts.items()
+    }
 
+
+def _update_booking_order(si, booking_order, is_charge=False):
+    bo = frappe.get_doc("Booking Order", booking_order)
+    if bo.docstatus == 2:
+        return
+
+    if is_charge:
+        return _update_charges(bo, si)
+
+    if not any([x.gg_update_freight for x in _get_booking_order_items(si, bo.name)]):
+        return
+
+    _update_freight(bo, si)
+    bo.set_totals()
+    bo.flags.ignore_validate_update_after_submit = True
     bo.save()
 
 
+def _get_booking_order_items(si, booking_order):
+    return [
+        x
+        for x in si.items
+        if (x.gg_booking_order or si.gg_booking_order) == booking_order
+    ]
+
+
 def _update_freight(bo, si):
     get_freight_row = compose(
         excepts(StopIteration, first, lambda _: None),
         lambda name: filter(lambda x: x.name == name, bo.freight),
     )
-    for sii in [x for x in si.items if x.gg_update_freight]:
+    for sii in [
+        x for x in _get_booking_order_items(si, bo.name) if x.gg_update_freight
+    ]:
         freight = get_freight_row(sii.gg_bo_detail)
         if freight:
             freight.based_on = frappe.get_cached_value(
@@ -131,64 +476,65 @@ def _update_freight(bo, si):
             freight.amount = sii.amount
 
 
-def _update_charges(bo):
-    invoices = frappe.get_all(
-        "Sales Invoice",
-        filters=[
-            ["docstatus", "=", 1],
-            ["gg_booking_order", "=", bo.name],
-            ["ifnull(gg_loading_operation, '')", "=", ""],
-        ],
-    )
-    bo.charges = []
-    charges = frappe.get_all(
-        "Sales Invoice Item",
-        filters={"parent": ("in", [x.get("name") for x in invoices])},
-        fields=[
-            "item_code as charge_type",
-            "amount as charge_amount",
-            "description as item_description",
-        ],
-        order_by="parent, idx",
+def _update_charges(bo, si):
+    # only one charge invoice can be submitted for a booking order, so its items
+    # are the charges. rows are written in place instead of saving the whole order
+    charges = [
+        {
+            "charge_type": x.item_code,
+            "charge_amount": x.amount,
+            "item_description": x.description,
+        }
+        for x in _get_booking_order_items(si, bo.name)
+    ]
+    existing = list(bo.charges)
+    for row, values in zip(existing, charges):
+        if any([row.get(k) != v for k, v in values.items()]):
+            row.update(values)
+            row.db_update()
+
+    for values in charges[len(existing) :]:
+        bo.append("charges", merge(values, {"docstatus": bo.docstatus})).db_insert()
+
+    removed = existing[len(charges) :]
+    if removed:
+        frappe.db.delete(
+            "Booking Order Charge", {"name": ("in", [x.name for x in removed])}
+        )
+        bo.charges = [x for x in bo.charges if x not in removed]
+
+    bo.set_totals()
+    frappe.db.set_value(
+        "Booking Order",
+        bo.name,
+        {"charge_total": bo.charge_total, "total_amount": bo.total_amount},
     )
-    for row in charges:
-        bo.append("charges", row)
 
 
 def _validate_freight_qty(doc):
-    bo = frappe.get_cached_doc("Booking Order", doc.gg_booking_order)
-    get_freight_row = compose(
-        excepts(StopIteration, first, lambda _: None),
-        lambda x: filter(lambda row: row.name == x, bo.freight),
-    )
+    items = [x for x in doc.items if x.gg_bo_detail]
+    if not items:
+        return None
 
-    for item in doc.items:
-        if item.gg_bo_detail:
-            freight_row = get_freight_row(item.gg_bo_detail)
-            if not freight_row:
-                return frappe._(
-                    "Invalid Booking Order Freight Detail found in row #{} for {}".format(
-                        item.idx, frappe.get_desk_link("Sales Invoice", doc.name)
-                    )
-                )
+    bo_details = list(set(x.gg_bo_detail for x in items))
+    freight_rows = _get_freight_rows(bo_details)
+    invoiced_qtys = _get_invoiced_qtys(bo_details)
 
-            total_qty = (
-                frappe.get_all(
-                    "Sales Invoice Item",
-                    filters={"docstatus": 1, "gg_bo_detail": item.gg_bo_detail},
-                    fields=["sum(qty)"],
-                    as_list=1,
-                )[0][0]
-                or 0
-            )
-            if frappe.utils.flt(total_qty + item.qty, precision=3) > _get_freight_qty(
-                freight_row
-            ):
-                return frappe._(
-                    "Total Qty will exceed Freight Qty declared in {}".format(
-                        frappe.get_desk_link("Booking Order", doc.gg_booking_order),
-                    )
+    for item in items:
+        booking_order = item.gg_booking_order or doc.gg_booking_order
+        freight_row = freight_rows.get(item.gg_bo_detail)
+        if not freight_row or freight_row.get("parent") != booking_order:
+            return frappe._(
+                "Invalid Booking Order Freight Detail found in row #{} for {}".format(
+                    item.idx, frappe.get_desk_link("Sales Invoice", doc.name)
                 )
+            )
+
+        total_qty = invoiced_qtys.get(item.gg_bo_detail, 0)
+        if frappe.utils.flt(total_qty + item.qty, precision=3) > _get_freight_qty(
+            freight_row
+        ):
+            return _get_exceeded_freight_qty_message(booking_order)
 
     return None
 
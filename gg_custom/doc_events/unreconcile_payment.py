@@ -0,0 +1,23 @@
+from gg_custom.api.booking_party import clear_customer_dashboard_cache
+from gg_custom.doc_events.sales_invoice import (
+    get_invoice_booking_orders,
+    refresh_billing_totals,
+)
+
+
+def on_submit(doc, method):
+    refresh_billing_totals(
+        get_invoice_booking_orders(
+            list(
+                set(
+                    [
+                        x.reference_name
+                        for x in doc.allocations
+                        if x.reference_doctype == "Sales Invoice"
+                    ]
+                )
+            )
+        )
+    )
+    if doc.party_type == "Customer":
+        clear_customer_dashboard_cache([doc.party])
@@ -6,26 +6,28 @@
 import frappe
 from frappe.model.document import Document
 
+from gg_custom.api.booking_log import update_balances, validate_loading_units
+from gg_custom.api.booking_order import clear_history_cache
+
 
 class BookingLog(Document):
     def validate(self):
-        existing_loading_unit = frappe.db.get_value(
-            "Booking Log",
-            filters={
-                "name": ("!=", self.name),
-                "booking_order": self.booking_order,
-                "bo_detail": self.bo_detail,
-                "activity": ("!=", "Booked"),
-            },
-            fieldname="loading_unit",
-        )
-        if existing_loading_unit and self.loading_unit != existing_loading_unit:
-            frappe.throw(
-                frappe._(
-                    "Previous Loading Operation on {} has already being performed based on {}. ".format(
-                        frappe.get_desk_link("Booking Order", self.booking_order),
-                        existing_loading_unit,
-                    )
-                    + "Please execute the current one based on the same unit."
-                )
-            )
+        validate_loading_units([self])
+
+    def after_insert(self):
+        update_balances([self])
+        clear_history_cache([self.booking_order])
+
+    def on_trash(self):
+        update_balances([self], reverse=True)
+        clear_history_cache([self.booking_order])
+
+
+def on_doctype_update():
+    for fields in [
+        ["station", "bo_detail"],
+        ["shipping_order", "bo_detail"],
+        ["bo_detail", "activity"],
+        ["posting_datetime", "station"],
+    ]:
+        frappe.db.add_index("Booking Log", fields)
@@ -2,8 +2,128 @@
 # Copyright (c) 2020, Libermatic and Contributors
 # See license.txt
 
-# import frappe
+import frappe
 import unittest
+from unittest.mock import patch
+
+from gg_custom.api.booking_log import delete_logs, validate_loading_units
+from gg_custom.api.booking_order import _get_history
+from gg_custom.gg_custom.report.booking_summary.booking_summary import _get_data
+
 
 class TestBookingLog(unittest.TestCase):
-	pass
+    @classmethod
+    def setUpClass(cls):
+        # enough rows for the optimizer to prefer an index over a full scan
+        for i in range(400):
+            frappe.db.sql(
+                """
+                    INSERT INTO `tabBooking Log` (
+                        name, posting_datetime, booking_order, bo_detail,
+                        shipping_order, station, loading_operation, activity,
+                        loading_unit, no_of_packages, weight_actual
+                    ) VALUES (
+                        %(name)s, %(posting_datetime)s, %(booking_order)s,
+                        %(bo_detail)s, %(shipping_order)s, %(station)s,
+                        %(loading_operation)s, %(activity)s, 'Packages', 1, 0
+                    )
+                """,
+                values={
+                    "name": "_Test BL {}".format(i),
+                    "posting_datetime": frappe.utils.add_to_date(
+                        "2020-01-01 00:00:00", hours=i
+                    ),
+                    "booking_order": "_Test BO {}".format(i % 100),
+                    "bo_detail": "_Test BOD {}".format(i % 50),
+                    "shipping_order": "_Test SO {}".format(i % 4),
+                    "station": "_Test Station {}".format(i % 4),
+                    "loading_operation": "_Test LO {}".format(i % 100),
+                    "activity": ["Booked", "Loaded", "Unloaded", "Collected"][i % 4],
+                },
+            )
+        frappe.db.commit()
+        frappe.db.sql("ANALYZE TABLE `tabBooking Log`")
+
+    @classmethod
+    def tearDownClass(cls):
+        frappe.db.sql("DELETE FROM `tabBooking Log` WHERE name LIKE '\\_Test BL %%'")
+        frappe.db.commit()
+
+    def tearDown(self):
+        frappe.db.rollback()
+
+    def get_keys(self, fn, *args, **kwargs):
+        """Indexes chosen for Booking Log in the statements executed by fn"""
+        sql = frappe.db.sql
+        keys = []
+
+        def explain(query, values=(), *args, **kwargs):
+            if "`tabBooking Log`" in query and query.strip().upper().startswith(
+                ("SELECT", "UPDATE", "WITH")
+            ):
+                keys.extend(
+                    x.get("key")
+                    for x in sql("EXPLAIN {}".format(query), values, as_dict=1)
+                    if x.get("table") in ["tabBooking Log", "log"]
+                )
+            return sql(query, values, *args, **kwargs)
+
+        with patch.object(frappe.db, "sql", side_effect=explain):
+            fn(*args, **kwargs)
+        return keys
+
+    def test_station_bo_detail_index(self):
+        self.assertIn(
+            "station_bo_detail_index",
+            self.get_keys(
+                delete_logs, "Booking Log", {"loading_operation": "_Test LO 1"}
+            ),
+        )
+
+    def test_shipping_order_bo_detail_index(self):
+        self.assertIn(
+            "shipping_order_bo_detail_index",
+            self.get_keys(
+                delete_logs, "Booking Log", {"loading_operation": "_Test LO 1"}
+            ),
+        )
+
+    def test_loading_operation_index(self):
+        self.assertIn(
+            "loading_operation",
+            self.get_keys(
+                delete_logs, "Booking Log", {"loading_operation": "_Test LO 1"}
+            ),
+        )
+
+    def test_bo_detail_activity_index(self):
+        self.assertEqual(
+            self.get_keys(
+                validate_loading_units,
+                [
+                    frappe._dict(
+                        booking_order="_Test BO 1",
+                        bo_detail="_Test BOD 1",
+                        activity="Loaded",
+                        loading_unit="Packages",
+                    )
+                ],
+            ),
+            ["bo_detail_activity_index"],
+        )
+
+    def test_booking_order_index(self):
+        keys = self.get_keys(_get_history, "_Test BO 1")
+        self.assertTrue(keys)
+        self.assertEqual(set(keys), {"booking_order"})
+
+    def test_posting_datetime_station_index(self):
+        keys = self.get_keys(
+            _get_data,
+            frappe._dict(
+                from_date="2020-01-02 00:00:00",
+                to_date="2020-01-02 05:59:59",
+                station="_Test Station 1",
+            ),
+        )
+        self.assertEqual(keys[0], "posting_datetime_station_index")
@@ -5,22 +5,18 @@
 
 import frappe
 from frappe.model.document import Document
-from frappe.query_builder.functions import Sum
 from toolz.curried import compose, excepts, first, map, filter
 
+from gg_custom.api.booking_log import insert_logs, delete_logs
 from gg_custom.api.booking_order import (
-    get_history,
-    make_sales_invoice,
+    make_sales_invoices,
     get_loading_conversion_factor,
     get_deliverable,
+    get_sales_invoices,
 )
 
 
 class BookingOrder(Document):
-    def onload(self):
-        if self.docstatus == 1:
-            self.set_onload("dashboard_info", _get_dashboard_info(self))
-
     def validate(self):
         if not self.freight or not self.freight_total:
             frappe.throw(frappe._("Freight cannot be empty or zero"))
@@ -51,6 +47,13 @@ class BookingOrder(Document):
     def before_submit(self):
         self.status = "Booked"
         self.payment_status = "Unbilled"
+        self.billed_total = 0
+        self.outstanding_total = 0
+        self.current_station = self.source_station
+        self.next_station = None
+        self.last_shipping_order = None
+        self.first_shipping_order = None
+        self.first_loaded_at = None
 
     def before_cancel(self):
         if self.payment_status == "Paid":
@@ -61,10 +64,9 @@ class BookingOrder(Document):
         self.payment_status = None
 
     def on_submit(self):
-        for row in self.freight:
-            frappe.get_doc(
+        insert_logs(
+            [
                 {
-                    "doctype": "Booking Log",
                     "posting_datetime": self.booking_datetime,
                     "booking_order": self.name,
                     "station": self.source_station,
@@ -73,30 +75,30 @@ class BookingOrder(Document):
                     "weight_actual": row.weight_actual,
                     "bo_detail": row.name,
                 }
-            ).insert(ignore_permissions=True)
+                for row in self.freight
+            ]
+        )
         if self.auto_bill_to:
-            frappe.flags.args = {
-                "bill_to": self.auto_bill_to.lower(),
-                "taxes_and_charges": None,
-            }
-            invoice = make_sales_invoice(
-                self.name, posting_datetime=self.booking_datetime
+            make_sales_invoices(
+                [(self.name, self.auto_bill_to.lower())],
+                posting_datetime=self.booking_datetime,
+                submit=True,
             )
-            invoice.insert(ignore_permissions=True)
-            invoice.submit()
 
     def on_cancel(self):
-        for (log_name,) in frappe.get_all(
-            "Booking Log", filters={"booking_order": self.name}, as_list=1
-        ):
-            frappe.delete_doc("Booking Log", log_name, ignore_permissions=True)
-
-        for (si_name,) in frappe.get_all(
-            "Sales Invoice",
-            filters={"docstatus": 1, "gg_booking_order": self.name},
-            as_list=1,
-        ):
+        delete_logs("Booking Log", {"booking_order": self.name})
+
+        for si_name in get_sales_invoices(self.name):
             si = frappe.get_doc("Sales Invoice", si_name)
+            if si.gg_booking_order != self.name:
+                frappe.throw(
+                    frappe._(
+                        "Cannot cancel an order billed in consolidated invoice {}. "
+                        "Please cancel the invoice first.".format(
+                            frappe.get_desk_link("Sales Invoice", si_name)
+                        )
+                    )
+                )
             if si.status == "Paid":
                 frappe.throw(
                     frappe._(
@@ -174,25 +176,6 @@ class BookingOrder(Document):
             self.save()
 
 
-def _get_dashboard_info(doc):
-    SalesInvoice = frappe.qb.DocType("Sales Invoice")
-    q = (
-        frappe.qb.from_(SalesInvoice)
-        .where(
-            (SalesInvoice.docstatus == 1) & (SalesInvoice.gg_booking_order == doc.name)
-        )
-        .select(
-            Sum(SalesInvoice.grand_total, "grand_total"),
-            Sum(SalesInvoice.outstanding_amount, "outstanding_amount"),
-        )
-    )
-    invoice = q.run(as_dict=1)[0]
-    return {
-        "invoice": invoice,
-        "history": get_history(doc.name),
-    }
-
-
 def _get_delivered_packages(bo_detail):
     return (
         frappe.get_all(
@@ -2,8 +2,102 @@
 # Copyright (c) 2020, Libermatic and Contributors
 # See license.txt
 
-# import frappe
+import frappe
 import unittest
 
+from gg_custom.doc_events import payment_entry
+from gg_custom.doc_events.sales_invoice import refresh_billing_totals
+
+
 class TestBookingOrder(unittest.TestCase):
-	pass
+    booking_orders = {"_Test BO 1": 300, "_Test BO 2": 100}
+    sales_invoice = "_Test Consolidated SI"
+
+    def setUp(self):
+        for name, amount in self.booking_orders.items():
+            frappe.db.sql(
+                """
+                    INSERT INTO `tabBooking Order`
+                        (name, docstatus, total_amount, billed_total, outstanding_total)
+                    VALUES (%(name)s, 1, %(amount)s, 0, 0)
+                """,
+                values={"name": name, "amount": amount},
+            )
+            frappe.db.sql(
+                """
+                    INSERT INTO `tabSales Invoice Item`
+                        (name, parent, parenttype, parentfield, gg_booking_order, amount)
+                    VALUES (%(item)s, %(parent)s, 'Sales Invoice', 'items', %(name)s, %(amount)s)
+                """,
+                values={
+                    "item": "{}-{}".format(self.sales_invoice, name),
+                    "parent": self.sales_invoice,
+                    "name": name,
+                    "amount": amount,
+                },
+            )
+        self._set_outstanding(400)
+
+    def tearDown(self):
+        frappe.db.rollback()
+
+    def test_payment_entry_cancel_restores_invoice_shares(self):
+        refresh_billing_totals(list(self.booking_orders.keys()))
+        billed = self._get_billing()
+        self.assertEqual(
+            billed,
+            {"_Test BO 1": (300, 300, "Unpaid"), "_Test BO 2": (100, 100, "Unpaid")},
+        )
+
+        pe = frappe._dict(
+            party_type="Customer",
+            party="_Test Customer",
+            references=[
+                frappe._dict(
+                    reference_doctype="Sales Invoice",
+                    reference_name=self.sales_invoice,
+                    allocated_amount=250,
+                )
+            ],
+        )
+        self._set_outstanding(150)
+        payment_entry.on_submit(pe, "on_submit")
+        self.assertEqual(
+            self._get_billing(),
+            {
+                "_Test BO 1": (300, 112.5, "Unpaid"),
+                "_Test BO 2": (100, 37.5, "Unpaid"),
+            },
+        )
+
+        self._set_outstanding(400)
+        payment_entry.on_cancel(pe, "on_cancel")
+        self.assertEqual(self._get_billing(), billed)
+
+    def _set_outstanding(self, outstanding_amount):
+        frappe.db.sql(
+            """
+                INSERT INTO `tabSales Invoice`
+                    (name, docstatus, total, outstanding_amount)
+                VALUES (%(name)s, 1, 400, %(outstanding_amount)s)
+                ON DUPLICATE KEY UPDATE outstanding_amount = %(outstanding_amount)s
+            """,
+            values={
+                "name": self.sales_invoice,
+                "outstanding_amount": outstanding_amount,
+            },
+        )
+
+    def _get_billing(self):
+        return {
+            x.name: (
+                frappe.utils.flt(x.billed_total),
+                frappe.utils.flt(x.outstanding_total),
+                x.payment_status,
+            )
+            for x in frappe.get_all(
+                "Booking Order",
+                filters={"name": ("in", list(self.booking_orders.keys()))},
+                fields=["name", "billed_total", "outstanding_total", "payment_status"],
+            )
+        }
@@ -7,18 +7,13 @@ import frappe
 from frappe.model.document import Document
 from frappe.contacts.address_and_contact import load_address_and_contact
 from erpnext.selling.doctype.customer.customer import make_address
-from erpnext.accounts.party import get_dashboard_info
 
-from gg_custom.api.booking_party import update_customer
+from gg_custom.api.booking_party import update_customer, clear_party_dashboard_cache
 
 
 class BookingParty(Document):
     def onload(self):
         load_address_and_contact(self)
-        if self.customer:
-            self.set_onload(
-                "dashboard_info", get_dashboard_info("Customer", self.customer)
-            )
 
     def validate(self):
         self.flags.is_new_doc = self.is_new()
@@ -52,6 +47,7 @@ class BookingParty(Document):
 
     def on_update(self):
         update_customer(self.name)
+        clear_party_dashboard_cache([self.name])
         if self.flags.is_new_doc and self.get("address_line1"):
             if not self.get("country"):
                 self.set("country", frappe.defaults.get_global_default("country"))
@@ -104,4 +100,5 @@ class BookingParty(Document):
             address.save(ignore_permissions=True)
 
         self.db_set("customer", doc.name)
+        clear_party_dashboard_cache([self.name])
         return doc
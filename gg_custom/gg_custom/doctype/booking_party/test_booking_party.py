@@ -2,8 +2,36 @@
 # Copyright (c) 2020, Libermatic and Contributors
 # See license.txt
 
-# import frappe
+import frappe
 import unittest
+from unittest.mock import patch
+
+from gg_custom.api.booking_party import allocate_payment
+
 
 class TestBookingParty(unittest.TestCase):
-	pass
+    def test_allocate_payment_to_open_invoices(self):
+        invoices = [
+            frappe._dict(
+                name=name,
+                posting_date="2020-01-01",
+                due_date="2020-01-31",
+                grand_total=amount,
+                outstanding_amount=amount,
+            )
+            for name, amount in [("_Test SI 1", 100), ("_Test SI 2", 200)]
+        ]
+        with patch(
+            "gg_custom.api.booking_party._get_open_invoices",
+            return_value=iter(invoices),
+        ), patch(
+            "gg_custom.api.booking_order.get_payment_entry",
+            return_value=frappe.new_doc("Payment Entry"),
+        ):
+            pe = allocate_payment("Customer", "_Test Customer", amount=150)
+
+        self.assertEqual(pe.paid_amount, 150)
+        self.assertEqual(
+            [(x.reference_name, x.allocated_amount) for x in pe.references],
+            [("_Test SI 1", 100), ("_Test SI 2", 50)],
+        )
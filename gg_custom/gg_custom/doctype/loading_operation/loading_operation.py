@@ -3,16 +3,31 @@
 # Copyright (c) 2020, Libermatic and contributors
 # For license information, please see license.txt
 
-from gg_custom.doc_events.sales_invoice import validate_invoice
+from gg_custom.doc_events.sales_invoice import (
+    validate_freight_loads,
+    get_freight_invoices,
+)
 import frappe
 from frappe.model.document import Document
 from frappe.query_builder.functions import Count
-from toolz.curried import compose, valmap, first, groupby
+from toolz.curried import compose, valmap, first, groupby, unique, merge
 
+from gg_custom.api.booking_log import insert_logs, delete_logs
 from gg_custom.api.booking_order import (
     get_orders_for,
     get_loading_conversion_factor,
-    make_sales_invoice,
+    get_sales_invoice_context,
+    make_sales_invoices,
+    make_consolidated_sales_invoice,
+    set_locations,
+    rebuild_locations,
+    set_first_loads,
+    rebuild_first_loads,
+)
+from gg_custom.api.shipping_order import (
+    insert_manifest_entries,
+    delete_manifest_entries,
+    update_load_totals,
 )
 
 
@@ -45,12 +60,28 @@ class LoadingOperation(Document):
             self.append("off_loads", booking_order)
 
     def before_save(self):
-        for load in self.on_loads + self.off_loads:
-            no_of_packages, weight_actual = frappe.get_cached_value(
-                "Booking Order Freight Detail",
-                load.bo_detail,
-                ["no_of_packages", "weight_actual"],
-            )
+        loads = self.on_loads + self.off_loads
+        freight_details = (
+            {
+                x.get("name"): x
+                for x in frappe.get_all(
+                    "Booking Order Freight Detail",
+                    filters={"name": ("in", list(set(x.bo_detail for x in loads)))},
+                    fields=["name", "no_of_packages", "weight_actual"],
+                )
+            }
+            if loads
+            else {}
+        )
+        precisions = (
+            {x: loads[0].precision(x) for x in ["no_of_packages", "weight_actual"]}
+            if loads
+            else {}
+        )
+        for load in loads:
+            freight_detail = freight_details.get(load.bo_detail) or {}
+            no_of_packages = freight_detail.get("no_of_packages") or 0
+            weight_actual = freight_detail.get("weight_actual") or 0
             conversion_factor = get_loading_conversion_factor(
                 load.qty, load.loading_unit, no_of_packages, weight_actual
             )
@@ -59,11 +90,11 @@ class LoadingOperation(Document):
 
             load.no_of_packages = frappe.utils.rounded(
                 no_of_packages * conversion_factor,
-                precision=load.precision("no_of_packages"),
+                precision=precisions.get("no_of_packages"),
             )
             load.weight_actual = frappe.utils.rounded(
                 weight_actual * conversion_factor,
-                precision=load.precision("weight_actual"),
+                precision=precisions.get("weight_actual"),
             )
 
         for param in ["no_of_packages", "weight_actual"]:
@@ -75,9 +106,23 @@ class LoadingOperation(Document):
         self.on_load_no_of_bookings = len(self.on_loads)
         self.off_load_no_of_bookings = len(self.off_loads)
 
+    def before_submit(self):
+        self.invoices = []
+        for booking_order, auto_bill_to in unique(
+            (x.booking_order, x.auto_bill_to) for x in self.on_loads if x.auto_bill_to
+        ):
+            self.append(
+                "invoices",
+                {
+                    "booking_order": booking_order,
+                    "auto_bill_to": auto_bill_to,
+                    "status": "Queued",
+                },
+            )
+
     def on_submit(self):
         _create_logs_and_set_statuses(self)
-        _create_sales_invoices(self)
+        _make_sales_invoices(self)
 
     def before_cancel(self):
         self._validate_shipping_order()
@@ -94,17 +139,20 @@ class LoadingOperation(Document):
         if len(booking_orders) == len(self.on_loads):
             frappe.throw(frappe._("Cannot remove all Booking Orders"))
 
+        delete_logs(
+            "Booking Log",
+            {
+                "loading_operation": self.name,
+                "bo_detail": ("in", [x.get("bo_detail") for x in booking_orders]),
+            },
+        )
+        rebuild_locations([x.get("booking_order") for x in booking_orders])
+        rebuild_first_loads([x.get("booking_order") for x in booking_orders])
+        delete_manifest_entries(
+            {"name": ("in", [x.get("name") for x in booking_orders])}
+        )
+        cancelled = []
         for row in booking_orders:
-            for (name,) in frappe.get_all(
-                "Booking Log",
-                filters={
-                    "loading_operation": self.name,
-                    "bo_detail": row.get("bo_detail"),
-                },
-                as_list=1,
-            ):
-                frappe.delete_doc("Booking Log", name, ignore_permissions=True)
-
             for (name,) in frappe.get_all(
                 "Sales Invoice Item",
                 fields=["parent"],
@@ -123,12 +171,25 @@ class LoadingOperation(Document):
                     invoice = frappe.get_doc("Sales Invoice", name)
                     invoice.flags.ignore_permissions = True
                     invoice.cancel()
+                    cancelled.append(name)
 
         to_remove = [x.get("name") for x in booking_orders]
+        update_load_totals(
+            self.shipping_order,
+            [x for x in self.on_loads if x.name in to_remove],
+            reverse=True,
+        )
         for row in self.on_loads:
             if row.name in to_remove:
                 self.on_loads.remove(row)
 
+        remaining = [x.booking_order for x in self.on_loads]
+        self.invoices = [x for x in self.invoices if x.booking_order in remaining]
+        # consolidated invoices also bill the Booking Orders that are not removed
+        requeued = [x for x in self.invoices if x.sales_invoice in cancelled]
+        for row in requeued:
+            row.update({"sales_invoice": None, "status": "Queued", "error": None})
+
         for param in ["no_of_packages", "weight_actual"]:
             self.set(
                 "on_load_{}".format(param), sum([x.get(param) for x in self.on_loads])
@@ -136,6 +197,18 @@ class LoadingOperation(Document):
         self.on_load_no_of_bookings = len(self.on_loads)
         self.flags.ignore_validate_update_after_submit = True
         self.save()
+        if requeued:
+            _make_sales_invoices(self)
+
+    @frappe.whitelist()
+    def create_invoices(self):
+        if self.docstatus != 1:
+            frappe.throw(frappe._("Loading Operation is not submitted"))
+
+        if all([x.status == "Completed" for x in self.invoices]):
+            frappe.throw(frappe._("All Sales Invoices have already been created"))
+
+        _enqueue_sales_invoices(self)
 
     def _validate_shipping_order(self):
         """disable validation"""
@@ -175,14 +248,14 @@ class LoadingOperation(Document):
         if bos:
             PaymentEntryReference = frappe.qb.DocType("Payment Entry Reference")
             PaymentEntry = frappe.qb.DocType("Payment Entry")
-            SalesInvoice = frappe.qb.DocType("Sales Invoice")
+            SalesInvoiceItem = frappe.qb.DocType("Sales Invoice Item")
             paid_invoice_count = (frappe.qb.from_(PaymentEntryReference)
                 .left_join(PaymentEntry).on(PaymentEntry.name == PaymentEntryReference.parent)
-                .left_join(SalesInvoice).on(SalesInvoice.name == PaymentEntryReference.reference_name)
+                .left_join(SalesInvoiceItem).on(SalesInvoiceItem.parent == PaymentEntryReference.reference_name)
                 .where(
                     (PaymentEntry.docstatus == 1)
                     & (PaymentEntryReference.reference_doctype == 'Sales Invoice')
-                    & (SalesInvoice.gg_booking_order.isin(bos))
+                    & (SalesInvoiceItem.gg_booking_order.isin(bos))
                 ).select(
                     Count(PaymentEntryReference.reference_name)
                 )
@@ -218,7 +291,11 @@ class LoadingOperation(Document):
                 return row.qty > orders.get(row.bo_detail, {}).get("weight_actual", 0)
             return row.qty > orders.get(row.bo_detail, {}).get("no_of_packages", 0)
 
-        on_loads_orders = get_map(get_orders_for(station=self.station))
+        on_loads_orders = get_map(
+            get_orders_for(
+                station=self.station, bo_details=[x.bo_detail for x in self.on_loads]
+            )
+        )
         on_load_rows_with_invalid_qty = [
             x.booking_order for x in self.on_loads if check_qty(on_loads_orders, x)
         ]
@@ -231,7 +308,12 @@ class LoadingOperation(Document):
                 )
             )
 
-        off_loads_orders = get_map(get_orders_for(shipping_order=self.shipping_order))
+        off_loads_orders = get_map(
+            get_orders_for(
+                shipping_order=self.shipping_order,
+                bo_details=[x.bo_detail for x in self.off_loads],
+            )
+        )
         off_load_rows_with_invalid_qty = [
             x.booking_order for x in self.off_loads if check_qty(off_loads_orders, x)
         ]
@@ -276,56 +358,53 @@ class LoadingOperation(Document):
                     )
                 )
 
-        errors = []
-        for item in [x for x in self.on_loads if x.auto_bill_to]:
-            frappe.flags.args = {
-                "bill_to": item.auto_bill_to.lower(),
-                "taxes_and_charges": None,
-                "is_freight_invoice": 1,
-                "loading_operation": self.name,
-            }
-            invoice = make_sales_invoice(
-                item.booking_order, posting_datetime=self.posting_datetime
-            )
-            invoice.flags.validate_loading = True
-            msg = validate_invoice(invoice, throw=False)
-            if msg:
-                errors.append(msg)
+        errors = validate_freight_loads(
+            self.name, [x.as_dict() for x in self.on_loads if x.auto_bill_to]
+        )
         if errors:
             frappe.throw(errors)
 
 
 def _create_logs_and_set_statuses(doc):
-    def create_log(load):
+    def make_log(load):
         if load.parentfield not in ["on_loads", "off_loads"]:
             frappe.throw(frappe._("Invalid Loading Operation load"))
 
         activity = "Loaded" if load.parentfield == "on_loads" else "Unloaded"
         direction = -1 if load.parentfield == "on_loads" else 1
-        frappe.get_doc(
-            {
-                "doctype": "Booking Log",
-                "posting_datetime": doc.posting_datetime,
-                "booking_order": load.booking_order,
-                "shipping_order": doc.shipping_order,
-                "station": doc.station,
-                "activity": activity,
-                "loading_operation": doc.name,
-                "loading_unit": load.loading_unit,
-                "no_of_packages": direction * load.no_of_packages,
-                "weight_actual": direction * load.weight_actual,
-                "bo_detail": load.bo_detail,
-            }
-        ).insert(ignore_permissions=True)
+        return {
+            "posting_datetime": doc.posting_datetime,
+            "booking_order": load.booking_order,
+            "shipping_order": doc.shipping_order,
+            "station": doc.station,
+            "activity": activity,
+            "loading_operation": doc.name,
+            "loading_unit": load.loading_unit,
+            "no_of_packages": direction * load.no_of_packages,
+            "weight_actual": direction * load.weight_actual,
+            "bo_detail": load.bo_detail,
+        }
 
-    for load in doc.on_loads + doc.off_loads:
-        create_log(load)
+    insert_logs([make_log(x) for x in doc.on_loads + doc.off_loads])
+    insert_manifest_entries(doc)
+    update_load_totals(doc.shipping_order, doc.on_loads + doc.off_loads)
 
-    for load in doc.on_loads:
-        bo = frappe.get_cached_doc("Booking Order", load.booking_order)
-        if bo.status == "Booked":
-            bo.status = "In Progress"
-            bo.save(ignore_permissions=True)
+    _update_booking_order_status(
+        [x.booking_order for x in doc.on_loads], "Booked", "In Progress"
+    )
+    on_loads = [x.booking_order for x in doc.on_loads]
+    set_locations(
+        on_loads,
+        last_shipping_order=doc.shipping_order,
+        current_station=doc.station,
+        next_station=None,
+    )
+    set_first_loads(on_loads, doc.shipping_order, doc.posting_datetime)
+    set_locations(
+        [x.booking_order for x in doc.off_loads if x.booking_order not in on_loads],
+        current_station=doc.station,
+        next_station=None,
+    )
 
     frappe.get_doc(
         {
@@ -341,42 +420,172 @@ def _create_logs_and_set_statuses(doc):
 
 def _remove_logs_and_set_statuses(doc):
     for log_type in ["Booking Log", "Shipping Log"]:
-        for (log_name,) in frappe.get_all(
-            log_type, filters={"loading_operation": doc.name}, as_list=1
-        ):
-            frappe.delete_doc(log_type, log_name, ignore_permissions=True)
-
-    for load in doc.on_loads:
-        bo = frappe.get_cached_doc("Booking Order", load.booking_order)
-        if bo.status == "In Progress" and not frappe.db.exists(
+        delete_logs(log_type, {"loading_operation": doc.name})
+    delete_manifest_entries({"loading_operation": doc.name})
+    update_load_totals(doc.shipping_order, doc.on_loads + doc.off_loads, reverse=True)
+
+    rebuild_locations([x.booking_order for x in doc.on_loads + doc.off_loads])
+    rebuild_first_loads([x.booking_order for x in doc.on_loads])
+    booking_orders = list(set(x.booking_order for x in doc.on_loads))
+    if not booking_orders:
+        return
+
+    still_loaded = [
+        x
+        for (x,) in frappe.get_all(
             "Booking Log",
-            {
-                "booking_order": bo.name,
-                "activity": "Loaded",
-                "loading_operation": ("!=", doc.name),
-            },
-        ):
-            bo.status = "Booked"
-            bo.save(ignore_permissions=True)
+            filters={"booking_order": ("in", booking_orders), "activity": "Loaded"},
+            fields=["booking_order"],
+            distinct=True,
+            as_list=1,
+        )
+    ]
+    _update_booking_order_status(
+        [x for x in booking_orders if x not in still_loaded], "In Progress", "Booked"
+    )
+
+
+def _update_booking_order_status(booking_orders, from_status, to_status):
+    names = list(set(booking_orders))
+    if not names:
+        return
+
+    BookingOrder = frappe.qb.DocType("Booking Order")
+    (
+        frappe.qb.update(BookingOrder)
+        .set(BookingOrder.status, to_status)
+        .set(BookingOrder.modified, frappe.utils.now())
+        .set(BookingOrder.modified_by, frappe.session.user)
+        .where(BookingOrder.name.isin(names))
+        .where(BookingOrder.status == from_status)
+    ).run()
+    for name in names:
+        frappe.clear_document_cache("Booking Order", name)
+
+
+def create_sales_invoices(loading_operation):
+    doc = frappe.get_doc("Loading Operation", loading_operation)
+    if doc.docstatus != 1:
+        return
+
+    _create_sales_invoices(doc, commit=True)
+    doc.notify_update()
+
+
+def _make_sales_invoices(doc):
+    if frappe.db.get_single_value(
+        "GG Custom Settings", "create_invoices_in_background"
+    ):
+        _enqueue_sales_invoices(doc)
+    else:
+        _create_sales_invoices(doc)
 
 
-def _create_sales_invoices(doc):
-    booking_orders = set(
-        [(x.booking_order, x.auto_bill_to) for x in doc.on_loads if x.auto_bill_to]
+def _enqueue_sales_invoices(doc):
+    frappe.enqueue(
+        "gg_custom.gg_custom.doctype.loading_operation.loading_operation.create_sales_invoices",
+        queue="long",
+        enqueue_after_commit=True,
+        loading_operation=doc.name,
     )
-    for booking_order, auto_bill_to in booking_orders:
-        frappe.flags.args = {
-            "bill_to": auto_bill_to.lower(),
-            "taxes_and_charges": None,
-            "is_freight_invoice": 1,
-            "loading_operation": doc.name,
-        }
-        invoice = make_sales_invoice(
-            booking_order, posting_datetime=doc.posting_datetime
+
+
+def _create_sales_invoices(doc, commit=False):
+    rows = [x for x in doc.invoices if x.status != "Completed"]
+    if not rows:
+        return
+
+    context = get_sales_invoice_context(
+        [x.booking_order for x in rows], loading_operation=doc.name
+    )
+    consolidate = frappe.db.get_single_value(
+        "GG Custom Settings", "consolidate_freight_invoices"
+    )
+    batches = (
+        _get_invoice_batches(rows, context) if consolidate else [[x] for x in rows]
+    )
+    for idx, batch in enumerate(batches):
+        if commit:
+            frappe.publish_progress(
+                idx * 100 / len(batches),
+                title=frappe._("Creating Sales Invoices"),
+                doctype=doc.doctype,
+                docname=doc.name,
+                description=", ".join([x.booking_order for x in batch]),
+            )
+        try:
+            invoices = _create_sales_invoice(doc, batch, context, consolidate)
+            for row in batch:
+                row.update(
+                    {
+                        "sales_invoice": invoices.get(row.booking_order),
+                        "status": "Completed",
+                        "error": None,
+                    }
+                )
+        except Exception as e:
+            if not commit:
+                raise
+            frappe.db.rollback()
+            frappe.log_error(title=f"Sales Invoice for {doc.name} failed")
+            for row in batch:
+                row.update({"sales_invoice": None, "status": "Failed", "error": str(e)})
+
+        for row in batch:
+            row.db_update()
+        if commit:
+            frappe.db.commit()
+
+
+def _get_invoice_batches(rows, context):
+    def get_party(row):
+        booking_order = context.booking_orders.get(row.booking_order) or {}
+        return booking_order.get(row.auto_bill_to.lower())
+
+    return list(groupby(get_party, rows).values())
+
+
+def _create_sales_invoice(doc, rows, context, consolidate=False):
+    booking_orders = [x.booking_order for x in rows]
+    # lock the booking orders so that concurrent jobs do not bill them twice
+    frappe.db.get_values(
+        "Booking Order", {"name": ("in", booking_orders)}, "name", for_update=True
+    )
+    invoices = get_freight_invoices(doc.name, booking_orders)
+    pending = [
+        (x.booking_order, x.auto_bill_to.lower())
+        for x in rows
+        if x.booking_order not in invoices
+    ]
+    if not pending:
+        return invoices
+
+    if consolidate:
+        invoice = make_consolidated_sales_invoice(
+            pending,
+            doc.name,
+            posting_datetime=doc.posting_datetime,
+            context=context,
+            submit=True,
         )
-        invoice.flags.skip_validation = True
-        invoice.insert(ignore_permissions=True)
-        invoice.submit()
+        return merge(invoices, {x: invoice.name for x, _ in pending})
+
+    return merge(
+        invoices,
+        {
+            x: invoice.name
+            for (x, _), invoice in zip(
+                pending,
+                make_sales_invoices(
+                    pending,
+                    loading_operation=doc.name,
+                    posting_datetime=doc.posting_datetime,
+                    context=context,
+                    submit=True,
+                ),
+            )
+        },
+    )
 
 
 def _cancel_sales_invoices(doc):
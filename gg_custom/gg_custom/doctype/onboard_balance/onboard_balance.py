@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2020, Libermatic and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class OnboardBalance(Document):
+    pass
+
+
+def on_doctype_update():
+    frappe.db.add_unique(
+        "Onboard Balance",
+        ["shipping_order", "bo_detail"],
+        constraint_name="unique_shipping_order_bo_detail",
+    )
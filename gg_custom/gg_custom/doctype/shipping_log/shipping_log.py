@@ -1,9 +1,26 @@
 # -*- coding: utf-8 -*-
+# pylint:disable=no-member
 # Copyright (c) 2020, Libermatic and contributors
 # For license information, please see license.txt
 
-# import frappe
+import frappe
 from frappe.model.document import Document
 
+from gg_custom.api.booking_order import clear_history_cache
+from gg_custom.api.shipping_order import clear_dashboard_cache
+
+
 class ShippingLog(Document):
-	pass
+    def after_insert(self):
+        clear_dashboard_cache([self.shipping_order])
+        if self.activity in ["Stopped", "Moving"]:
+            clear_history_cache(
+                frappe.get_all(
+                    "Booking Order",
+                    filters={
+                        "docstatus": 1,
+                        "last_shipping_order": self.shipping_order,
+                    },
+                    pluck="name",
+                )
+            )
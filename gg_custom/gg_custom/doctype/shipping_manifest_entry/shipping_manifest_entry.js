@@ -0,0 +1,8 @@
+// Copyright (c) 2020, Libermatic and contributors
+// For license information, please see license.txt
+
+frappe.ui.form.on('Shipping Manifest Entry', {
+	// refresh: function(frm) {
+
+	// }
+});
@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2020, Libermatic and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class ShippingManifestEntry(Document):
+    pass
+
+
+def on_doctype_update():
+    frappe.db.add_index(
+        "Shipping Manifest Entry", ["shipping_order", "loading_operation", "idx"]
+    )
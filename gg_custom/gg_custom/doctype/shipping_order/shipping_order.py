@@ -5,22 +5,13 @@
 
 import frappe
 from frappe.model.document import Document
-from frappe.query_builder.functions import Sum
-from toolz.curried import (
-    unique,
-    pluck,
-    map,
-    compose,
-)
+from frappe.query_builder import Case
+from toolz.curried import unique
 
-from gg_custom.api.shipping_order import get_history, get_order_contents
+from gg_custom.api.booking_log import delete_logs
 
 
 class ShippingOrder(Document):
-    def onload(self):
-        if self.docstatus == 1:
-            self.set_onload("dashboard_info", _get_dashboard_info(self))
-
     def validate(self):
         if self.initial_station == self.final_station:
             frappe.throw(frappe._("Initial and Final Stations cannot be same."))
@@ -122,10 +113,7 @@ class ShippingOrder(Document):
         self.status = "Cancelled"
 
     def on_cancel(self):
-        for (log_name,) in frappe.get_all(
-            "Shipping Log", filters={"shipping_order": self.name}, as_list=1
-        ):
-            frappe.delete_doc("Shipping Log", log_name, ignore_permissions=True)
+        delete_logs("Shipping Log", {"shipping_order": self.name})
 
     @frappe.whitelist()
     def stop(self, station, posting_datetime=None):
@@ -145,7 +133,12 @@ class ShippingOrder(Document):
         self.current_station = station
         self.next_station = None
         self.save()
-        _update_booking_orders(self)
+        _update_booking_orders(
+            self,
+            last_shipping_order=self.name,
+            current_station=station,
+            next_station=None,
+        )
 
         frappe.get_doc(
             {
@@ -174,7 +167,12 @@ class ShippingOrder(Document):
         self.next_station = station
         self.current_station = None
         self.save()
-        _update_booking_orders(self)
+        _update_booking_orders(
+            self,
+            last_shipping_order=self.name,
+            current_station=None,
+            next_station=station,
+        )
 
         frappe.get_doc(
             {
@@ -192,7 +190,7 @@ class ShippingOrder(Document):
             frappe.throw(
                 frappe._("Shipping Order can only be completed when it has stopped.")
             )
-        if validate_onboard and _current_onboard_bookings(self):
+        if validate_onboard and _current_onboard_bookings(self.name):
             frappe.throw(
                 frappe._(
                     "Shipping Order cannot be completed because some Booking Orders "
@@ -213,67 +211,52 @@ class ShippingOrder(Document):
         ).insert(ignore_permissions=True)
 
 
-def _update_booking_orders(shipping_order):
-    for bo in pluck(
-        "name",
-        frappe.get_all(
-            "Booking Order",
-            filters={
-                "docstatus": 1,
-                "status": ("in", ["Loaded", "In Transit"]),
-                "last_shipping_order": shipping_order.name,
-            },
-        ),
+def _update_booking_orders(doc, **locations):
+    if frappe.db.get_single_value(
+        "GG Custom Settings", "update_booking_orders_in_background"
     ):
-        doc = frappe.get_cached_doc("Booking Order", bo)
-        doc.status = "In Transit"
-        doc.current_station = shipping_order.current_station
-        doc.save()
+        frappe.enqueue(
+            "gg_custom.gg_custom.doctype.shipping_order.shipping_order.update_booking_orders",
+            enqueue_after_commit=True,
+            shipping_order=doc.name,
+            **locations,
+        )
+    else:
+        update_booking_orders(doc.name, **locations)
 
 
-def _get_dashboard_info(doc):
-    contents = get_order_contents(doc)
-    PurchaseInvoice = frappe.qb.DocType("Purchase Invoice")
-    q = (
-        frappe.qb.from_(PurchaseInvoice)
-        .where(
-            (PurchaseInvoice.docstatus == 1)
-            & (PurchaseInvoice.gg_shipping_order == doc.name)
-        )
-        .select(
-            Sum(PurchaseInvoice.rounded_total, "rounded_total"),
-            Sum(PurchaseInvoice.outstanding_amount, "outstanding_amount"),
-        )
-    )
-    invoice = q.run(as_dict=1)[0]
+def update_booking_orders(shipping_order, **locations):
+    booking_orders = _current_onboard_bookings(shipping_order)
+    if not booking_orders:
+        return
 
-    return {
-        **contents,
-        "invoice": invoice,
-        "history": get_history(doc.name),
-    }
+    BookingOrder = frappe.qb.DocType("Booking Order")
+    q = frappe.qb.update(BookingOrder)
+    for field, value in locations.items():
+        q = q.set(BookingOrder[field], value)
+    (
+        q.set(
+            BookingOrder.status,
+            Case()
+            .when(BookingOrder.status == "Booked", "In Progress")
+            .else_(BookingOrder.status),
+        )
+        .set(BookingOrder.modified, frappe.utils.now())
+        .set(BookingOrder.modified_by, frappe.session.user)
+        .where(BookingOrder.name.isin(booking_orders))
+        .where(BookingOrder.docstatus == 1)
+    ).run()
+    for name in booking_orders:
+        frappe.clear_document_cache("Booking Order", name)
 
 
-def _current_onboard_bookings(doc):
-    LoadingOperationBookingOrder = frappe.qb.DocType("Loading Operation Booking Order")
-    LoadingOperation = frappe.qb.DocType("Loading Operation")
+def _current_onboard_bookings(shipping_order):
+    OnboardBalance = frappe.qb.DocType("Onboard Balance")
     q = (
-        frappe.qb.from_(LoadingOperationBookingOrder)
-        .left_join(LoadingOperation)
-        .on(LoadingOperation.name == LoadingOperationBookingOrder.parent)
-        .where(
-            (LoadingOperation.docstatus == 1)
-            & (LoadingOperation.shipping_order == doc.name)
-        )
-        .select(LoadingOperationBookingOrder.booking_order)
-    )
-    get_booking_orders = compose(
-        list,
-        map(lambda x: x[0]),
-        lambda x: q.where(LoadingOperationBookingOrder.parentfield == x).run(),
+        frappe.qb.from_(OnboardBalance)
+        .where(OnboardBalance.shipping_order == shipping_order)
+        .where((OnboardBalance.no_of_packages > 0) | (OnboardBalance.weight_actual > 0))
+        .select(OnboardBalance.booking_order)
+        .distinct()
     )
-    return [
-        x
-        for x in get_booking_orders("on_loads")
-        if x not in get_booking_orders("off_loads")
-    ]
+    return [x for (x,) in q.run()]
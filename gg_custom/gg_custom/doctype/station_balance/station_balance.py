@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2020, Libermatic and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class StationBalance(Document):
+    pass
+
+
+def on_doctype_update():
+    frappe.db.add_unique(
+        "Station Balance",
+        ["station", "bo_detail"],
+        constraint_name="unique_station_bo_detail",
+    )
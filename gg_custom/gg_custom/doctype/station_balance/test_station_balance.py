@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2020, Libermatic and Contributors
+# See license.txt
+
+# import frappe
+import unittest
+
+class TestStationBalance(unittest.TestCase):
+	pass
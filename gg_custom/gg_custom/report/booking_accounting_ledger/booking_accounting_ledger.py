@@ -2,10 +2,10 @@
 # For license information, please see license.txt
 
 import frappe
-from frappe.query_builder.functions import IfNull
+from frappe.query_builder.functions import IfNull, Min, Sum
 from erpnext.accounts.report.general_ledger.general_ledger import execute as get_report
 from erpnext.accounts.party import get_party_account
-from toolz.curried import groupby, valmap, first, compose, merge
+from toolz.curried import groupby, valmap, first, compose, merge, concat
 
 
 def execute(filters=None):
@@ -127,22 +127,48 @@ def _get_data(filters):
 
     gl_entries = rows[1:-2]
 
-    SalesInvoice = frappe.qb.DocType("Sales Invoice")
-    BookingOrder = frappe.qb.DocType("Booking Order")
     invoices = [
         x.get("voucher_no")
         for x in gl_entries
         if x.get("voucher_type") == "Sales Invoice"
     ]
-    get_booking_orders = compose(valmap(first), groupby("sales_invoice"))
+
+    SalesInvoiceItem = frappe.qb.DocType("Sales Invoice Item")
+    # consolidated invoices bill several booking orders and are split per order
+    invoice_orders = (
+        groupby(
+            "sales_invoice",
+            frappe.qb.from_(SalesInvoiceItem)
+            .where(SalesInvoiceItem.parent.isin(invoices))
+            .select(
+                SalesInvoiceItem.parent.as_("sales_invoice"),
+                SalesInvoiceItem.gg_booking_order.as_("booking_order"),
+                Sum(SalesInvoiceItem.amount).as_("amount"),
+            )
+            .groupby(SalesInvoiceItem.parent, SalesInvoiceItem.gg_booking_order)
+            .orderby(SalesInvoiceItem.parent)
+            .orderby(Min(SalesInvoiceItem.idx))
+            .run(as_dict=1),
+        )
+        if invoices
+        else {}
+    )
+
+    BookingOrder = frappe.qb.DocType("Booking Order")
+    orders = list(
+        set(
+            x.get("booking_order")
+            for rows in invoice_orders.values()
+            for x in rows
+            if x.get("booking_order")
+        )
+    )
+    get_booking_orders = compose(valmap(first), groupby("name"))
     booking_orders = (
         get_booking_orders(
-            frappe.qb.from_(SalesInvoice)
-            .left_join(BookingOrder)
-            .on(BookingOrder.name == SalesInvoice.gg_booking_order)
-            .where(SalesInvoice.name.isin(invoices))
+            frappe.qb.from_(BookingOrder)
+            .where(BookingOrder.name.isin(orders))
             .select(
-                SalesInvoice.name.as_("sales_invoice"),
                 BookingOrder.name,
                 BookingOrder.paper_receipt_no,
                 BookingOrder.consignor_name.as_("consignor"),
@@ -151,22 +177,21 @@ def _get_data(filters):
             )
             .run(as_dict=1)
         )
-        if invoices
+        if orders
         else {}
     )
 
-    SalesInvoiceItem = frappe.qb.DocType("Sales Invoice Item")
     BookingOrderFreightDetail = frappe.qb.DocType("Booking Order Freight Detail")
-    orders = [v.get("name") for _, v in booking_orders.items()]
     sales_invoice_items = (
         groupby(
-            "sales_invoice",
+            lambda x: (x.get("sales_invoice"), x.get("booking_order")),
             frappe.qb.from_(SalesInvoiceItem)
             .left_join(BookingOrderFreightDetail)
             .on(BookingOrderFreightDetail.name == SalesInvoiceItem.gg_bo_detail)
             .where(SalesInvoiceItem.parent.isin(invoices))
             .select(
                 SalesInvoiceItem.parent.as_("sales_invoice"),
+                SalesInvoiceItem.gg_booking_order.as_("booking_order"),
                 SalesInvoiceItem.description,
                 SalesInvoiceItem.qty,
                 SalesInvoiceItem.rate,
@@ -215,11 +240,11 @@ def _get_data(filters):
 
         return "{} @ {}".format(item.get("description"), rate)
 
-    def make_description(si):
+    def make_description(si, bo):
         return "<br />".join(
             [
                 make_message(x)
-                for x in sales_invoice_items.get(si, [])
+                for x in sales_invoice_items.get((si, bo), [])
                 if x.get("qty") and x.get("rate")
             ]
         )
@@ -236,16 +261,15 @@ def _get_data(filters):
             )
         )
 
-    def make_row(row):
-        booking_order = booking_orders.get(row.get("voucher_no"), {})
-        bo_name = booking_order.get("name")
+    def make_row(row, bo_name=None):
+        booking_order = booking_orders.get(bo_name, {})
         order_date = booking_order.get("order_datetime")
         return merge(
             row,
             {
                 "booking_order": bo_name,
                 "paper_receipt_no": booking_order.get("paper_receipt_no"),
-                "description": make_description(row.get("voucher_no"))
+                "description": make_description(row.get("voucher_no"), bo_name)
                 if row.get("voucher_type") == "Sales Invoice"
                 else (row.remarks.split("\n")[0] if row.get("remarks") else ""),
                 "consignor": booking_order.get("consignor"),
@@ -257,11 +281,53 @@ def _get_data(filters):
             },
         )
 
+    def make_rows(row):
+        if row.get("voucher_type") != "Sales Invoice":
+            return [make_row(row)]
+
+        parts = invoice_orders.get(row.get("voucher_no")) or [{}]
+        if len(parts) == 1:
+            return [make_row(row, parts[0].get("booking_order"))]
+
+        total = sum([x.get("amount") or 0 for x in parts])
+        balance = (
+            (row.get("balance") or 0)
+            - (row.get("debit") or 0)
+            + (row.get("credit") or 0)
+        )
+        debit, credit = 0, 0
+        result = []
+        for idx, part in enumerate(parts, start=1):
+            if idx == len(parts):
+                part_debit = (row.get("debit") or 0) - debit
+                part_credit = (row.get("credit") or 0) - credit
+            else:
+                share = (part.get("amount") or 0) / total if total else 1 / len(parts)
+                part_debit = frappe.utils.flt((row.get("debit") or 0) * share, 2)
+                part_credit = frappe.utils.flt((row.get("credit") or 0) * share, 2)
+            debit += part_debit
+            credit += part_credit
+            balance += part_debit - part_credit
+            result.append(
+                make_row(
+                    merge(
+                        row,
+                        {
+                            "debit": part_debit,
+                            "credit": part_credit,
+                            "balance": balance,
+                        },
+                    ),
+                    part.get("booking_order"),
+                )
+            )
+        return result
+
     def make_ag_row(row, label):
         return merge(row, {"voucher_type": label})
 
     return (
         [make_ag_row(rows[0], "Opening")]
-        + [make_row(x) for x in gl_entries]
+        + list(concat([make_rows(x) for x in gl_entries]))
         + [make_ag_row(rows[-2], "Total"), make_ag_row(rows[-1], "Closing")]
     )
@@ -75,6 +75,7 @@ app_include_js = ["gg_custom.bundle.js"]
 
 # before_install = "gg_custom.install.before_install"
 # after_install = "gg_custom.install.after_install"
+after_migrate = "gg_custom.install.after_migrate"
 
 boot_session = "gg_custom.boot.boot_session"
 
@@ -112,10 +113,21 @@ doc_events = {
     },
     "Purchase Invoice": {
         "validate": "gg_custom.doc_events.purchase_invoice.validate",
+        "on_submit": "gg_custom.doc_events.purchase_invoice.on_submit",
+        "on_cancel": "gg_custom.doc_events.purchase_invoice.on_cancel",
     },
     "Payment Entry": {
         "on_submit": "gg_custom.doc_events.payment_entry.on_submit",
         "on_cancel": "gg_custom.doc_events.payment_entry.on_cancel",
+        "on_update_after_submit": "gg_custom.doc_events.payment_entry.on_update_after_submit",
+    },
+    "Journal Entry": {
+        "on_submit": "gg_custom.doc_events.journal_entry.on_submit",
+        "on_cancel": "gg_custom.doc_events.journal_entry.on_cancel",
+        "on_update_after_submit": "gg_custom.doc_events.journal_entry.on_update_after_submit",
+    },
+    "Unreconcile Payment": {
+        "on_submit": "gg_custom.doc_events.unreconcile_payment.on_submit",
     },
     "Item": {"validate": "gg_custom.doc_events.item.validate"},
 }
@@ -169,5 +181,6 @@ jinja = {
         "gg_custom.api.shipping_order.get_freight_summary_rows",
         "gg_custom.api.shipping_order.get_shipping_order_invoice",
         "gg_custom.api.booking_party.get_party_open_orders",
+        "gg_custom.api.booking_party.get_party_open_order_rows",
     ]
 }
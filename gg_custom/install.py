@@ -0,0 +1,45 @@
+import frappe
+
+
+indexes = {
+    "Sales Invoice": [
+        ["gg_loading_operation"],
+        ["gg_booking_order", "docstatus"],
+    ],
+    "Sales Invoice Item": [
+        ["gg_bo_detail", "docstatus"],
+        ["gg_booking_order", "docstatus"],
+    ],
+    "Purchase Invoice": [
+        ["gg_shipping_order"],
+    ],
+}
+
+
+def after_migrate():
+    add_indexes()
+
+
+def add_indexes():
+    for doctype, fieldsets in indexes.items():
+        for fields in fieldsets:
+            if all(frappe.db.has_column(doctype, x) for x in fields):
+                _add_index(doctype, fields)
+
+
+def _add_index(doctype, fields):
+    # single field indexes are named the same as the ones created by search_index
+    index_name = fields[0] if len(fields) == 1 else "{}_index".format("_".join(fields))
+    if frappe.db.has_index(f"tab{doctype}", index_name):
+        return
+
+    frappe.db.sql_ddl(
+        """
+            ALTER TABLE `tab{doctype}`
+            ADD INDEX `{index_name}` ({columns}), ALGORITHM=INPLACE, LOCK=NONE
+        """.format(
+            doctype=doctype,
+            index_name=index_name,
+            columns=", ".join(f"`{x}`" for x in fields),
+        )
+    )
@@ -0,0 +1,8 @@
+import frappe
+
+from gg_custom.gg_custom.doctype.booking_log.booking_log import on_doctype_update
+
+
+def execute():
+    frappe.reload_doc("gg_custom", "doctype", "booking_log")
+    on_doctype_update()
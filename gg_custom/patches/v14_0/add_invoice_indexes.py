@@ -0,0 +1,15 @@
+import frappe
+
+from gg_custom.install import add_indexes
+
+
+def execute():
+    for name in [
+        "Sales Invoice-gg_loading_operation",
+        "Purchase Invoice-gg_shipping_order",
+    ]:
+        if frappe.db.exists("Custom Field", name):
+            frappe.db.set_value(
+                "Custom Field", name, "search_index", 1, update_modified=False
+            )
+    add_indexes()
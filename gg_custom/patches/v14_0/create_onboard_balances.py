@@ -0,0 +1,8 @@
+import frappe
+
+from gg_custom.api.booking_log import rebuild_onboard_balances
+
+
+def execute():
+    frappe.reload_doc("gg_custom", "doctype", "onboard_balance")
+    rebuild_onboard_balances()
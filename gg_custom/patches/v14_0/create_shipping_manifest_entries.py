@@ -0,0 +1,8 @@
+import frappe
+
+from gg_custom.api.shipping_order import rebuild_manifest_entries
+
+
+def execute():
+    frappe.reload_doc("gg_custom", "doctype", "shipping_manifest_entry")
+    rebuild_manifest_entries()
@@ -0,0 +1,8 @@
+import frappe
+
+from gg_custom.api.booking_log import rebuild_station_balances
+
+
+def execute():
+    frappe.reload_doc("gg_custom", "doctype", "station_balance")
+    rebuild_station_balances()
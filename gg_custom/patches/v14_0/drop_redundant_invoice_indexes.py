@@ -0,0 +1,20 @@
+import frappe
+
+
+def execute():
+    # covered by the (field, docstatus) composite indexes in gg_custom.install
+    for doctype, fieldname in [
+        ("Sales Invoice", "gg_booking_order"),
+        ("Sales Invoice Item", "gg_bo_detail"),
+        ("Sales Invoice Item", "gg_booking_order"),
+    ]:
+        name = f"{doctype}-{fieldname}"
+        if frappe.db.exists("Custom Field", name):
+            frappe.db.set_value(
+                "Custom Field", name, "search_index", 0, update_modified=False
+            )
+        if frappe.db.has_index(f"tab{doctype}", fieldname):
+            frappe.db.sql_ddl(
+                f"ALTER TABLE `tab{doctype}` DROP INDEX `{fieldname}`, "
+                "ALGORITHM=INPLACE, LOCK=NONE"
+            )
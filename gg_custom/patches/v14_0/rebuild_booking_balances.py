@@ -0,0 +1,6 @@
+from gg_custom.api.booking_log import rebuild_station_balances, rebuild_onboard_balances
+
+
+def execute():
+    rebuild_station_balances()
+    rebuild_onboard_balances()
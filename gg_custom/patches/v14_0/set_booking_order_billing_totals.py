@@ -0,0 +1,8 @@
+import frappe
+
+from gg_custom.doc_events.sales_invoice import rebuild_billing_totals
+
+
+def execute():
+    frappe.reload_doc("gg_custom", "doctype", "booking_order")
+    rebuild_billing_totals()
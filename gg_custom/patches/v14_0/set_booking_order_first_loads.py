@@ -0,0 +1,27 @@
+import frappe
+
+from gg_custom.api.booking_order import rebuild_first_loads
+
+
+def execute():
+    frappe.reload_doc("gg_custom", "doctype", "booking_order")
+
+    chunk_size = 1000
+    last = ""
+    while True:
+        names = [
+            x
+            for (x,) in frappe.get_all(
+                "Booking Order",
+                filters={"docstatus": 1, "name": (">", last)},
+                order_by="name",
+                limit_page_length=chunk_size,
+                as_list=1,
+            )
+        ]
+        if not names:
+            break
+
+        rebuild_first_loads(names)
+        frappe.db.commit()
+        last = names[-1]
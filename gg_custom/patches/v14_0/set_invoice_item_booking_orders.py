@@ -0,0 +1,29 @@
+import frappe
+
+
+def execute():
+    if not frappe.db.exists("Custom Field", "Sales Invoice Item-gg_booking_order"):
+        frappe.get_doc(
+            {
+                "doctype": "Custom Field",
+                "dt": "Sales Invoice Item",
+                "label": "Booking Order",
+                "fieldname": "gg_booking_order",
+                "insert_after": "gg_bo_detail",
+                "fieldtype": "Link",
+                "options": "Booking Order",
+                "read_only": 1,
+                "search_index": 0,
+            }
+        ).insert()
+
+    frappe.db.sql(
+        """
+            UPDATE `tabSales Invoice Item` AS sii
+            JOIN `tabSales Invoice` AS si ON si.name = sii.parent
+            SET sii.gg_booking_order = si.gg_booking_order
+            WHERE
+                IFNULL(si.gg_booking_order, '') != '' AND
+                IFNULL(sii.gg_booking_order, '') = ''
+        """
+    )
@@ -0,0 +1,8 @@
+import frappe
+
+from gg_custom.api.shipping_order import rebuild_load_totals
+
+
+def execute():
+    frappe.reload_doc("gg_custom", "doctype", "shipping_order")
+    rebuild_load_totals()
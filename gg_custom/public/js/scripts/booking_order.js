@@ -1,4 +1,4 @@
-import { set_charge_type_query, sumBy } from './utils';
+import { set_charge_type_query, sumBy, get_dashboard_info } from './utils';
 import Timeline from '../vue/Timeline.vue';
 
 export function booking_order_freight_detail() {
@@ -51,7 +51,7 @@ export function booking_order() {
       });
       set_charge_type_query(frm);
     },
-    refresh: function (frm) {
+    refresh: async function (frm) {
       if (frm.doc.docstatus === 1) {
         frm.add_custom_button('Deliver', handle_deliver(frm));
 
@@ -59,19 +59,19 @@ export function booking_order() {
           .add_custom_button('Create Invoice', () => create_invoice(frm))
           .addClass('btn-primary');
 
-        const {
-          dashboard_info: { invoice: { outstanding_amount = 0 } = {} } = {},
-        } = frm.doc.__onload || {};
-        if (outstanding_amount > 0) {
-          frm.add_custom_button('Create Payment', () => create_payment(frm));
-        }
         frm.page.add_menu_item('Update Party Details', () =>
           update_party_details(frm)
         );
-      }
-      if (frm.doc.docstatus > 0) {
-        const { dashboard_info } = frm.doc.__onload || {};
+
+        const dashboard_info = await get_dashboard_info(
+          frm,
+          'gg_custom.api.booking_order.get_dashboard_info'
+        );
         if (dashboard_info) {
+          const { invoice: { outstanding_amount = 0 } = {} } = dashboard_info;
+          if (outstanding_amount > 0) {
+            frm.add_custom_button('Create Payment', () => create_payment(frm));
+          }
           render_dashboard(frm, dashboard_info);
         }
       }
@@ -1,3 +1,5 @@
+import { get_dashboard_info } from './utils';
+
 export function booking_party() {
   return {
     setup: function (frm) {
@@ -10,7 +12,7 @@ export function booking_party() {
         };
       });
     },
-    refresh: function (frm) {
+    refresh: async function (frm) {
       frappe.dynamic_link = {
         doc: frm.doc,
         fieldname: 'name',
@@ -40,12 +42,20 @@ export function booking_party() {
         });
       }
       if (!frm.doc.__islocal && frm.doc.__onload) {
-        erpnext.utils.set_party_dashboard_indicators(frm);
         render_booking_order_links(frm);
       }
 
       if (!frm.doc.__islocal && frm.doc.customer) {
         frm.add_custom_button('Create Payment', () => create_payment(frm));
+
+        const dashboard_info = await get_dashboard_info(
+          frm,
+          'gg_custom.api.booking_party.get_party_dashboard_info'
+        );
+        if (dashboard_info) {
+          frm.doc.__onload = { ...frm.doc.__onload, dashboard_info };
+          erpnext.utils.set_party_dashboard_indicators(frm);
+        }
       }
     },
     primary_address: function (frm) {
@@ -103,8 +113,23 @@ function render_booking_order_links(frm) {
 }
 
 function create_payment(frm) {
-  frappe.model.open_mapped_doc({
-    method: 'gg_custom.api.booking_party.make_payment_entry',
-    frm,
-  });
+  frappe.prompt(
+    [
+      {
+        fieldtype: 'Currency',
+        fieldname: 'amount',
+        label: __('Received Amount'),
+        description: __(
+          'Allocated to the oldest invoices first. Leave empty to allocate all open invoices.'
+        ),
+      },
+    ],
+    ({ amount }) =>
+      frappe.model.open_mapped_doc({
+        method: 'gg_custom.api.booking_party.make_payment_entry',
+        frm,
+        args: { amount },
+      }),
+    __('Create Payment')
+  );
 }
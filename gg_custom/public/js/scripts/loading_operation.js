@@ -68,6 +68,23 @@ export function loading_operation() {
           set_totals(frm);
         });
       }
+      const pending_invoices = (frm.doc.invoices || []).filter(
+        ({ status }) => status !== 'Completed'
+      );
+      if (frm.doc.docstatus === 1 && pending_invoices.length > 0) {
+        frm.dashboard.set_headline_alert(
+          `${pending_invoices.length} Sales Invoice(s) pending. ` +
+            'Please check the Invoices section for details.',
+          'orange'
+        );
+        frm.add_custom_button('Create Pending Invoices', async function () {
+          await frm.call('create_invoices');
+          frappe.show_alert({
+            message: 'Sales Invoices will be created in the background.',
+            indicator: 'green',
+          });
+        });
+      }
       if (
         frm.doc.docstatus === 1 &&
         frm.doc.on_loads &&
@@ -1,5 +1,6 @@
 import ShippingOrderLoad from '../vue/ShippingOrderLoad.vue';
 import Timeline from '../vue/Timeline.vue';
+import { get_dashboard_info } from './utils';
 
 export function shipping_order() {
   return {
@@ -20,7 +21,7 @@ export function shipping_order() {
       frm.set_query('vehicle', (doc) => ({ filters: { disabled: 0 } }));
       frm.set_query('driver', (doc) => ({ filters: { status: 'Active' } }));
     },
-    refresh: function (frm) {
+    refresh: async function (frm) {
       if (frm.doc.docstatus === 1) {
         const { status } = frm.doc;
         if (!['Completed', 'Cancelled'].includes(status)) {
@@ -43,17 +44,6 @@ export function shipping_order() {
             )
             .addClass('btn-primary');
         }
-        const {
-          dashboard_info: { invoice: { outstanding_amount = 0 } = {} } = {},
-        } = frm.doc.__onload || {};
-        if (outstanding_amount > 0) {
-          frm.add_custom_button('Create Payment', () =>
-            frappe.model.open_mapped_doc({
-              method: 'gg_custom.api.shipping_order.make_payment_entry',
-              frm,
-            })
-          );
-        }
         if (status === 'Stopped') {
           frm.add_custom_button('Move', handle_movement_action(frm));
           frm.add_custom_button('Complete', () =>
@@ -75,9 +65,21 @@ export function shipping_order() {
           frm.add_custom_button('Stop', handle_movement_action(frm));
         }
       }
-      if (frm.doc.docstatus > 0) {
-        const { dashboard_info } = frm.doc.__onload || {};
+      if (frm.doc.docstatus === 1) {
+        const dashboard_info = await get_dashboard_info(
+          frm,
+          'gg_custom.api.shipping_order.get_dashboard_info'
+        );
         if (dashboard_info) {
+          const { invoice: { outstanding_amount = 0 } = {} } = dashboard_info;
+          if (outstanding_amount > 0) {
+            frm.add_custom_button('Create Payment', () =>
+              frappe.model.open_mapped_doc({
+                method: 'gg_custom.api.shipping_order.make_payment_entry',
+                frm,
+              })
+            );
+          }
           render_dashboard(frm, dashboard_info);
         }
       }
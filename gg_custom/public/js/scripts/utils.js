@@ -10,3 +10,13 @@ export const sumBy = R.compose(
   R.reduce((a, x) => a + (x ?? 0), 0),
   R.pluck
 );
+
+export async function get_dashboard_info(frm, method) {
+  const { doctype, name } = frm.doc;
+  const { message } = await frappe.call({ method, args: { name } });
+  // the form might have moved on to another document in the meantime
+  if (frm.doc.doctype !== doctype || frm.doc.name !== name) {
+    return null;
+  }
+  return message;
+}